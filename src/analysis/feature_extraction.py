@@ -0,0 +1,104 @@
+import logging
+import os
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.signal import welch
+from typing import Dict, List, Optional, Tuple
+
+from src.analysis.tfr import band_matrix
+from src.utils.file_handling import ArrayStore
+
+logger = logging.getLogger(__name__)
+
+
+def compute_band_power(
+    stc_trials: np.ndarray,
+    sfreq: float,
+    freq_bands: Dict[str, List[float]],
+    nperseg: Optional[int] = None,
+) -> np.ndarray:
+    """Trial-averaged Welch band power of a (n_trials, n_rois, n_times) tensor
+
+    All trials and ROIs go through a single welch call; returns (n_rois, n_bands).
+    """
+    nperseg = min(int(sfreq), stc_trials.shape[-1]) if nperseg is None else nperseg
+    freqs, psd = welch(np.asarray(stc_trials), fs=sfreq, nperseg=nperseg, axis=-1)
+    psd = np.nanmean(psd, axis=0)  # average over trials
+    return psd @ band_matrix(freqs, freq_bands).T
+
+
+def _subject_band_power(processor, subject_id, freq_bands, nperseg):
+    stc_trials = processor._load_stc_trials(subject_id)
+    return compute_band_power(stc_trials, processor.sfreq, freq_bands, nperseg)
+
+
+def load_features(output_path: str, table_name: str = "band_power") -> Tuple[np.ndarray, Dict]:
+    """Read a feature table (n_subjects, n_rois, n_bands) and its manifest"""
+    features, manifest = ArrayStore(output_path).read("features", table_name)
+    return np.array(features), manifest
+
+
+def extract_features(
+    processor,
+    subject_ids: List[str],
+    freq_bands: Dict[str, List[float]],
+    output_path: str,
+    table_name: str = "band_power",
+    nperseg: Optional[int] = None,
+    n_jobs: int = 1,
+) -> Tuple[np.ndarray, List[str]]:
+    """Build (or extend) the subject x ROI x band feature table for subject_ids
+
+    Subjects already in the table with the same settings are read back rather
+    than recomputed, unless one of their source files (STC pickle or stimulus
+    labels) has changed since; the rest are computed in one batched
+    (optionally parallel) job and written back with the table.
+    """
+    store = ArrayStore(output_path)
+    settings = {
+        "sfreq": processor.sfreq,
+        "nperseg": nperseg,
+        "freq_bands": freq_bands,
+        "roi_acronyms": processor.roi_acronyms,
+    }
+
+    # source mtimes of the requested subjects, recorded per subject in the manifest
+    sources = {
+        sub_id: {fname: os.path.getmtime(fname) for fname in processor._stc_sources(sub_id)}
+        for sub_id in subject_ids
+    }
+    table, table_sources = {}, {}
+    if store.is_fresh("features", table_name, []):
+        features, manifest = load_features(output_path, table_name)
+        if manifest["settings"] == settings:
+            table = dict(zip(manifest["subject_ids"], features))
+            table_sources = manifest.get("sources_per_subject", {})
+
+    stale = [
+        sub_id
+        for sub_id in subject_ids
+        if sub_id in table and table_sources.get(sub_id) != sources[sub_id]
+    ]
+    if stale:
+        logger.info("Sources changed for %d subjects, recomputing: %s", len(stale), stale)
+    missing = [sub_id for sub_id in subject_ids if sub_id not in table or sub_id in stale]
+    if missing:
+        logger.info("Computing band-power features for %d subjects", len(missing))
+        new_features = Parallel(n_jobs=n_jobs)(
+            delayed(_subject_band_power)(processor, sub_id, freq_bands, nperseg)
+            for sub_id in missing
+        )
+        table.update(zip(missing, new_features))
+        table_sources.update({sub_id: sources[sub_id] for sub_id in missing})
+
+        table_ids = list(table)
+        store.write(
+            "features",
+            table_name,
+            np.stack([table[sub_id] for sub_id in table_ids]),
+            subject_ids=table_ids,
+            settings=settings,
+            sources_per_subject={sub_id: table_sources.get(sub_id) for sub_id in table_ids},
+        )
+
+    return np.stack([table[sub_id] for sub_id in subject_ids]), list(subject_ids)
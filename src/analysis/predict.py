@@ -0,0 +1,80 @@
+import logging
+import os
+import pickle
+import time
+import pandas as pd
+from typing import Dict, List, Optional
+
+from src.analysis.feature_extraction import extract_features
+from src.utils.registry import FileCatalog
+
+logger = logging.getLogger(__name__)
+
+
+def subject_ids_from_dir(recordings_dir: str) -> List[str]:
+    """Subject IDs of every *_epochs.pkl STC recording in a directory"""
+    suffix = "_epochs.pkl"
+    return sorted(
+        os.path.basename(fname)[: -len(suffix)]
+        for fname in FileCatalog().glob(recordings_dir, f"*{suffix}")
+    )
+
+
+class BatchScorer:
+    """Loads an exported model once and scores any number of subjects with it
+
+    Seconds per stage of the last score() call are kept in timings and logged.
+    """
+
+    def __init__(
+        self,
+        model_fname: str,
+        processor,
+        freq_bands: Dict[str, List[float]],
+        features_path: str,
+        n_jobs: int = 1,
+    ):
+        with open(model_fname, "rb") as f:
+            self.model = pickle.load(f)
+        self.model_fname = model_fname
+        self.processor = processor
+        self.freq_bands = freq_bands
+        self.features_path = features_path
+        self.n_jobs = n_jobs
+        self.timings = {}
+
+    def _stage(self, name: str, start: float, n_subjects: int):
+        elapsed = time.perf_counter() - start
+        self.timings[name] = elapsed
+        rate = n_subjects / elapsed if elapsed > 0 else float("inf")
+        logger.info("%s: %.2f s (%.1f subjects/s)", name, elapsed, rate)
+
+    def score(self, subject_ids: List[str], output_csv: Optional[str] = None) -> pd.DataFrame:
+        assert len(subject_ids) > 0, "No subjects to score"
+        self.timings = {}
+
+        start = time.perf_counter()
+        features, subject_ids = extract_features(
+            self.processor,
+            subject_ids,
+            self.freq_bands,
+            self.features_path,
+            n_jobs=self.n_jobs,
+        )
+        self._stage("features", start, len(subject_ids))
+
+        # a single predict_proba call for the whole batch
+        start = time.perf_counter()
+        proba = self.model.predict_proba(features.reshape(len(subject_ids), -1))
+        self._stage("predict", start, len(subject_ids))
+
+        scores = pd.DataFrame({"subject_id": subject_ids})
+        for i, label in enumerate(self.model.classes_):
+            scores[f"proba_{label}"] = proba[:, i]
+
+        if output_csv is not None:
+            start = time.perf_counter()
+            os.makedirs(os.path.dirname(os.path.abspath(output_csv)), exist_ok=True)
+            scores.to_csv(output_csv, index=False)
+            self._stage("write", start, len(subject_ids))
+        return scores
@@ -0,0 +1,70 @@
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+
+def welch_stream(
+    data: np.ndarray,
+    sfreq: float,
+    nperseg: Optional[int] = None,
+    noverlap: Optional[int] = None,
+    chunk_segments: int = 64,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Welch PSD of (..., n_times) data read chunk_segments segments at a time
+
+    Chunks start on segment boundaries and overlap by noverlap samples, so the
+    result equals scipy.signal.welch on the whole recording while only one
+    chunk is in memory; data can be memory-mapped.
+    """
+    # scipy.signal is slow to import and the processor imports this module
+    from scipy.signal import welch
+
+    n_times = data.shape[-1]
+    nperseg = min(int(sfreq) if nperseg is None else nperseg, n_times)
+    noverlap = nperseg // 2 if noverlap is None else noverlap
+    step = nperseg - noverlap
+    n_segments = (n_times - nperseg) // step + 1
+
+    psd_sum = None
+    for first in range(0, n_segments, chunk_segments):
+        n_chunk = min(chunk_segments, n_segments - first)
+        start = first * step
+        stop = start + (n_chunk - 1) * step + nperseg
+        chunk = np.asarray(data[..., start:stop], dtype=np.float64)
+        freqs, psd = welch(chunk, fs=sfreq, nperseg=nperseg, noverlap=noverlap, axis=-1)
+        psd_sum = psd * n_chunk if psd_sum is None else psd_sum + psd * n_chunk
+    return freqs, psd_sum / n_segments
+
+
+class RestingSpectrum:
+    """Group resting-state spectrum: mean PSD plus per-subject band power
+
+    psd is the group mean (n_rois, n_freqs); band_power is
+    (n_subjects, n_rois, n_bands), NaN for subjects without a resting recording.
+    """
+
+    def __init__(
+        self,
+        freqs: np.ndarray,
+        psd: np.ndarray,
+        band_power: np.ndarray,
+        freq_bands: Dict[str, List[float]],
+        subject_ids: List[str],
+    ):
+        self.freqs = freqs
+        self.psd = psd
+        self.band_power = band_power
+        self.freq_bands = freq_bands
+        self.subject_ids = subject_ids
+
+    def band_psd(self) -> np.ndarray:
+        """Group mean PSD collapsed to freq_bands, (n_rois, n_bands)"""
+        from src.analysis.tfr import band_matrix
+
+        return self.psd @ band_matrix(self.freqs, self.freq_bands).T
+
+    def __str__(self):
+        n_missing = int(np.isnan(self.band_power).all(axis=(1, 2)).sum())
+        return (
+            f"RestingSpectrum: {len(self.subject_ids)} subjects ({n_missing} without resting data), "
+            f"{self.psd.shape[0]} ROIs, {len(self.freqs)} freqs, bands {list(self.freq_bands)}"
+        )
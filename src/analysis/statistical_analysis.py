@@ -0,0 +1,299 @@
+import numpy as np
+from joblib import Parallel, delayed
+from scipy import ndimage, stats
+from typing import Dict, List, Optional, Tuple
+
+from src.analysis.tfr import MorletTFR, zscore_tfr
+
+# clusters connect along freq and time only, never across permutations or ROIs
+_CLUSTER_STRUCTURE = np.zeros((3, 3, 3, 3), dtype=bool)
+_CLUSTER_STRUCTURE[1, 1] = ndimage.generate_binary_structure(2, 1)
+
+
+def _tfr_freqs(freqs: Optional[np.ndarray], n_cycles: Optional[np.ndarray]):
+    # the frequencies of Visualizer._compute_tfr unless given
+    freqs = np.logspace(*np.log10([1, 100]), num=50) if freqs is None else freqs
+    return freqs, freqs / 2.0 if n_cycles is None else n_cycles
+
+
+def _subject_ids(group) -> List[str]:
+    return [subject.subject_id for subject in group.subjects]
+
+
+def _subject_power(processor, subject_id, freqs, n_cycles, decim, labels):
+    # power of the subject's trial-averaged STC, as in _compute_tfr
+    stc_mean = processor._load_stc_epochs(subject_id, labels)
+    times = np.asarray(processor._read_epochs_data(subject_id)[1]["times"])[::decim]
+    power = MorletTFR(processor.sfreq, freqs, n_cycles, decim=decim, dtype=processor.dtype).transform(
+        stc_mean[np.newaxis], output="avg_power"
+    )
+    return power.astype(processor.dtype), times
+
+
+def subject_power_tensors(
+    processor,
+    subject_ids: List[str],
+    freqs: Optional[np.ndarray] = None,
+    n_cycles: Optional[np.ndarray] = None,
+    decim: int = 4,
+    labels=(3,),
+    n_jobs: int = 1,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(n_subjects, n_rois, n_freqs, n_times) TFR power before baseline z-scoring, and its times
+
+    Compute this once and z-score it with zscore_tfr for every baseline.
+    """
+    freqs, n_cycles = _tfr_freqs(freqs, n_cycles)
+    powers = Parallel(n_jobs=n_jobs)(
+        delayed(_subject_power)(processor, sub_id, freqs, n_cycles, decim, labels)
+        for sub_id in subject_ids
+    )
+    return np.stack([power for power, _ in powers]), powers[0][1]
+
+
+def subject_tfr_tensors(
+    processor,
+    subject_ids: List[str],
+    freqs: np.ndarray,
+    n_cycles: np.ndarray,
+    baseline: Tuple[float, float] = (-2.5, 0.0),
+    time_range: Tuple[float, float] = (-0.2, 0.8),
+    decim: int = 4,
+    labels=(3,),
+    n_jobs: int = 1,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(n_subjects, n_rois, n_freqs, n_times) baseline z-scored TFRs, and their times"""
+    power, times = subject_power_tensors(
+        processor, subject_ids, freqs, n_cycles, decim, labels, n_jobs
+    )
+    return zscore_tfr(power, times, baseline, time_range)
+
+
+def ttest_ind_batch(
+    X: np.ndarray, labels: np.ndarray, total: np.ndarray, total_sq: np.ndarray
+) -> np.ndarray:
+    """Pooled-variance two-sample t for many group assignments at once
+
+    X is (n_subjects, n_features); labels is (n_perms, n_subjects) with 1 for
+    group one, and every row has the same group sizes. Only group one's sums
+    depend on the assignment (the squared sums cancel in the pooled variance),
+    so a whole batch costs one matrix product and no permuted copy of X.
+    Returns (n_perms, n_features).
+    """
+    n = X.shape[0]
+    n1 = labels[0].sum()
+    n2 = n - n1
+    sum1 = labels @ X
+    # pooled sum of squares: total_sq - sum1**2 / n1 - (total - sum1)**2 / n2
+    rest = total - sum1
+    ss = total_sq - rest**2 / n2
+    ss -= sum1**2 / n1
+    np.maximum(ss, 0, out=ss)
+    ss *= (1 / n1 + 1 / n2) / (n - 2)
+    np.sqrt(ss, out=ss)
+    sum1 /= n1
+    sum1 -= rest / n2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sum1 /= ss
+    return np.nan_to_num(sum1, copy=False)
+
+
+def _cluster_masses(t_maps: np.ndarray, threshold: float, tail: int):
+    """Labels and masses (sum of t) of supra-threshold clusters
+
+    t_maps is (n_perms, n_rois, n_freqs, n_times); each sign is labelled with a
+    single ndimage.label call over the whole stack.
+    """
+    results = []
+    signs = {0: (1, -1), 1: (1,), -1: (-1,)}[tail]
+    for sign in signs:
+        labels, n_clusters = ndimage.label(sign * t_maps > threshold, _CLUSTER_STRUCTURE)
+        masses = np.bincount(labels.ravel(), weights=t_maps.ravel(), minlength=n_clusters + 1)
+        results.append((labels, masses))
+    return results
+
+
+def _max_cluster_mass(t_maps: np.ndarray, threshold: float, tail: int) -> np.ndarray:
+    # largest |cluster mass| per (permutation, ROI); 0 where nothing crosses threshold
+    n_perms, n_rois = t_maps.shape[:2]
+    max_mass = np.zeros(n_perms * n_rois)
+    for labels, masses in _cluster_masses(t_maps, threshold, tail):
+        # labels are numbered in scan order and no cluster spans two (permutation,
+        # ROI) maps, so each map owns a contiguous range ending at its largest label
+        last = np.maximum.accumulate(labels.reshape(n_perms * n_rois, -1).max(axis=1))
+        owner = np.searchsorted(last, np.arange(1, len(masses)))
+        np.maximum.at(max_mass, owner, np.abs(masses[1:]))
+    return max_mass.reshape(n_perms, n_rois)
+
+
+def _null_batch(X, n1, n_perms, seed, threshold, tail, shape, total, total_sq):
+    rng = np.random.default_rng(seed)
+    labels = np.zeros((n_perms, X.shape[0]))
+    for row in labels:
+        row[rng.permutation(X.shape[0])[:n1]] = 1
+    t_maps = ttest_ind_batch(X, labels, total, total_sq).reshape((n_perms,) + shape)
+    return _max_cluster_mass(t_maps, threshold, tail)
+
+
+def cluster_permutation_test(
+    X1: np.ndarray,
+    X2: np.ndarray,
+    n_permutations: int = 5000,
+    threshold: Optional[float] = None,
+    tail: int = 0,
+    seed: int = 0,
+    batch_size: int = 64,
+    n_jobs: int = 1,
+) -> Dict:
+    """Cluster-based permutation test between two groups of (n_rois, n_freqs, n_times) maps
+
+    X1 and X2 are (n_subjects, n_rois, n_freqs, n_times). Clusters are
+    connected over freq x time within each ROI, and each ROI is tested against
+    its own max-cluster-mass null distribution. Permutations run in batches of
+    batch_size in a process pool; each batch has its own seed spawned from
+    seed, so results do not depend on n_jobs. threshold defaults to the
+    two-sided p < 0.05 t value.
+
+    Returns a dict with t_obs (n_rois, n_freqs, n_times), clusters (a list of
+    {"roi", "mask", "mass", "p_value"}) and null (n_permutations, n_rois).
+    """
+    assert X1.shape[1:] == X2.shape[1:], "Both groups need the same ROI x freq x time shape"
+    shape = X1.shape[1:]
+    n1, n2 = len(X1), len(X2)
+    df = n1 + n2 - 2
+    if threshold is None:
+        threshold = stats.t.ppf(1 - 0.05 / 2, df) if tail == 0 else stats.t.ppf(1 - 0.05, df)
+
+    X = np.concatenate([X1, X2]).reshape(n1 + n2, -1).astype(np.float64)
+    total, total_sq = X.sum(axis=0), (X * X).sum(axis=0)
+    observed = np.zeros((1, n1 + n2))
+    observed[0, :n1] = 1
+    t_obs = ttest_ind_batch(X, observed, total, total_sq).reshape((1,) + shape)
+
+    batches = [
+        min(batch_size, n_permutations - start) for start in range(0, n_permutations, batch_size)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+    null = Parallel(n_jobs=n_jobs, max_nbytes="1M", mmap_mode="r")(
+        delayed(_null_batch)(X, n1, n_perms, batch_seed, threshold, tail, shape, total, total_sq)
+        for n_perms, batch_seed in zip(batches, seeds)
+    )
+    null = np.concatenate(null)
+
+    clusters = []
+    for labels, masses in _cluster_masses(t_obs, threshold, tail):
+        for cluster_id in range(1, len(masses)):
+            mask = labels[0] == cluster_id
+            roi = int(np.flatnonzero(mask.any(axis=(1, 2)))[0])
+            mass = float(masses[cluster_id])
+            p_value = (np.sum(null[:, roi] >= abs(mass)) + 1) / (n_permutations + 1)
+            clusters.append({"roi": roi, "mask": mask[roi], "mass": mass, "p_value": p_value})
+    clusters.sort(key=lambda cluster: cluster["p_value"])
+    return {"t_obs": t_obs[0], "clusters": clusters, "null": null, "threshold": threshold}
+
+
+def significance_mask(result: Dict, alpha: float = 0.05) -> np.ndarray:
+    """(n_rois, n_freqs, n_times) mask of the clusters with p < alpha"""
+    mask = np.zeros(result["t_obs"].shape, dtype=bool)
+    for cluster in result["clusters"]:
+        if cluster["p_value"] < alpha:
+            mask[cluster["roi"]] |= cluster["mask"]
+    return mask
+
+
+def compare_groups(
+    processor,
+    group1,
+    group2,
+    freqs: Optional[np.ndarray] = None,
+    n_cycles: Optional[np.ndarray] = None,
+    baseline: Tuple[float, float] = (-2.5, 0.0),
+    time_range: Tuple[float, float] = (-0.2, 0.8),
+    decim: int = 4,
+    n_permutations: int = 5000,
+    seed: int = 0,
+    n_jobs: int = 1,
+    power: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+    **kwargs,
+) -> Dict:
+    """Cluster permutation test of two SubjectGroups' baseline z-scored TFRs
+
+    Uses the same frequencies as Visualizer._compute_tfr by default; the
+    result also carries the freqs and times of t_obs. power is the groups'
+    (power1, power2, times) from subject_power_tensors with the same freqs
+    and decim; passing it lets several baselines share one TFR per subject.
+    """
+    freqs, n_cycles = _tfr_freqs(freqs, n_cycles)
+    if power is None:
+        power1, times = subject_power_tensors(
+            processor, _subject_ids(group1), freqs, n_cycles, decim, n_jobs=n_jobs
+        )
+        power2, _ = subject_power_tensors(
+            processor, _subject_ids(group2), freqs, n_cycles, decim, n_jobs=n_jobs
+        )
+    else:
+        power1, power2, times = power
+    X1, ztimes = zscore_tfr(power1, times, baseline, time_range)
+    X2, _ = zscore_tfr(power2, times, baseline, time_range)
+    result = cluster_permutation_test(
+        X1, X2, n_permutations=n_permutations, seed=seed, n_jobs=n_jobs, **kwargs
+    )
+    result.update(freqs=freqs, times=ztimes)
+    return result
+
+
+def _sorted_quantiles(sorted_values: np.ndarray, quantiles) -> np.ndarray:
+    # np.nanquantile (linear method) along the last axis of an array sorted with
+    # NaNs last, from each row's count of non-NaN values
+    n_valid = (~np.isnan(sorted_values)).sum(axis=-1)
+    rows = np.arange(len(sorted_values))
+    result = np.full((len(quantiles), len(sorted_values)), np.nan)
+    has_values = n_valid > 0
+    for i, q in enumerate(quantiles):
+        position = q * (n_valid[has_values] - 1)
+        below = np.floor(position).astype(np.int64)
+        above = np.minimum(below + 1, n_valid[has_values] - 1)
+        low = sorted_values[rows[has_values], below]
+        high = sorted_values[rows[has_values], above]
+        result[i, has_values] = low + (position - below) * (high - low)
+    return result
+
+
+def bootstrap_ci(
+    data: np.ndarray,
+    n_resamples: int = 10000,
+    ci: float = 0.95,
+    seed: int = 0,
+    max_bytes: int = 256 * 1024**2,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Percentile bootstrap interval of the NaN-aware mean over subjects (axis 0)
+
+    data is (n_subjects, ...), e.g. subject x channel x time. All resamples
+    are drawn as one (n_resamples, n_subjects) index matrix and turned into
+    per-resample subject counts, so the resampled nanmeans of a block of
+    features are two matrix products (sum of values, number of non-NaN
+    values) rather than a gathered (resamples x subjects x features) copy.
+    Features are processed in blocks whose resample means fit in max_bytes.
+    Returns lower and upper bounds of shape data.shape[1:], NaN where no
+    subject has data.
+    """
+    n_subjects = data.shape[0]
+    flat = data.reshape(n_subjects, -1)
+    rng = np.random.default_rng(seed)
+    index = rng.integers(0, n_subjects, size=(n_resamples, n_subjects))
+    offsets = np.arange(n_resamples)[:, np.newaxis] * n_subjects
+    counts = np.bincount((index + offsets).ravel(), minlength=n_resamples * n_subjects)
+    counts = counts.reshape(n_subjects, n_resamples, order="F").astype(np.float64)
+
+    quantiles = [(1 - ci) / 2, (1 + ci) / 2]
+    bounds = np.empty((2, flat.shape[1]))
+    block = max(1, max_bytes // (n_resamples * 8 * 2))
+    for start in range(0, flat.shape[1], block):
+        values = np.asarray(flat[:, start : start + block], dtype=np.float64).T
+        valid = ~np.isnan(values)
+        # (features, resamples), so the sort below runs along contiguous rows
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = (np.where(valid, values, 0) @ counts) / (valid @ counts)
+        means.sort(axis=-1)
+        bounds[:, start : start + block] = _sorted_quantiles(means, quantiles)
+    return bounds[0].reshape(data.shape[1:]), bounds[1].reshape(data.shape[1:])
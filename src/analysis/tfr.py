@@ -0,0 +1,249 @@
+import numpy as np
+from scipy.fft import fft, ifft, next_fast_len
+from typing import Dict, List, Optional, Tuple, Union
+
+
+class MorletTFR:
+    """Batched FFT Morlet transform with decimated and band-limited output
+
+    Uses the same wavelets as mne.time_frequency.tfr_array_morlet, but takes one
+    FFT per signal, multiplies it by a precomputed wavelet bank, and decimates
+    in the frequency domain (folding the spectrum) so that only
+    n_times / decim output samples are inverse transformed. Memory is bounded
+    by bytes, not counts: channels are read chunk_bytes of spectra (epochs x
+    channels x n_fft) at a time, wavelet products are formed in tiles of
+    epochs x freqs of at most tile_bytes (small enough to stay in cache, and
+    reduced to power before the next tile), and long recordings are split
+    into overlapping time blocks.
+
+    dtype=np.float32 runs the FFTs and wavelet products in complex64 and
+    returns float32 power; epoch averages are still accumulated in float64.
+    """
+
+    def __init__(
+        self,
+        sfreq: float,
+        freqs: np.ndarray,
+        n_cycles: Union[float, np.ndarray],
+        decim: int = 1,
+        zero_mean: bool = False,
+        chunk_bytes: int = 64 * 1024**2,
+        tile_bytes: int = 1024**2,
+        block_size: Optional[int] = 2**15,
+        dtype=np.float64,
+    ):
+        self.dtype = np.dtype(dtype)
+        self.complex_dtype = np.result_type(self.dtype, np.complex64)
+        self.sfreq = float(sfreq)
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.n_cycles = np.broadcast_to(
+            np.asarray(n_cycles, dtype=float), self.freqs.shape
+        )
+        self.decim = int(decim)
+        self.chunk_bytes = chunk_bytes  # signal spectra per channel chunk
+        self.tile_bytes = tile_bytes  # one epochs x freqs wavelet product
+        self.block_size = block_size  # output samples per time block
+        self.wavelets = self._morlet(zero_mean)
+
+        # half-width of the longest wavelet, rounded up to whole decimation steps
+        self.pad = (max(w.size for w in self.wavelets) - 1) // 2
+        self.pad = -(-self.pad // self.decim) * self.decim
+        self._banks = {}
+
+    def _morlet(self, zero_mean: bool) -> List[np.ndarray]:
+        # same construction and scaling as mne.time_frequency.morlet
+        wavelets = []
+        for f, n_cycles in zip(self.freqs, self.n_cycles):
+            sigma_t = n_cycles / (2.0 * np.pi * f)
+            t = np.arange(0.0, 5.0 * sigma_t, 1.0 / self.sfreq)
+            t = np.r_[-t[::-1], t[1:]]
+            oscillation = np.exp(2.0 * 1j * np.pi * f * t)
+            if zero_mean:
+                oscillation -= np.exp(-2 * (np.pi * f * sigma_t) ** 2)
+            W = oscillation * np.exp(-(t**2) / (2.0 * sigma_t**2))
+            W /= np.sqrt(0.5) * np.linalg.norm(W.ravel())
+            wavelets.append(W)
+        return wavelets
+
+    def _bank(self, nfft: int) -> np.ndarray:
+        # wavelet spectra with each wavelet centred on sample 0 (circularly),
+        # so the first n_times samples of the product are the "same"-mode output
+        if nfft not in self._banks:
+            bank = np.zeros((len(self.wavelets), nfft), dtype=np.complex128)
+            for i, W in enumerate(self.wavelets):
+                half = (W.size - 1) // 2
+                bank[i, : W.size - half] = W[half:]
+                bank[i, nfft - half :] = W[:half]
+            self._banks[nfft] = fft(bank, axis=-1).astype(self.complex_dtype)
+        return self._banks[nfft]
+
+    def _nfft(self, n_samples: int) -> int:
+        # long enough to avoid circular wrap-around, and a multiple of decim
+        n = n_samples + 2 * self.pad
+        return self.decim * next_fast_len(-(-n // self.decim))
+
+    def _time_block(self, n_times: int) -> int:
+        block = n_times if self.block_size is None else self.block_size
+        return max(self.decim, block - block % self.decim)
+
+    def _tile_shape(self, n_epochs: int, nfft: int) -> Tuple[int, int]:
+        # epochs x freqs per wavelet product, as square as tile_bytes allows
+        n_rows = max(1, self.tile_bytes // (nfft * self.complex_dtype.itemsize))
+        n_freqs = min(len(self.freqs), max(1, int(np.sqrt(n_rows))))
+        return min(n_epochs, max(1, n_rows // n_freqs)), n_freqs
+
+    def _cwt_tiles(self, X: np.ndarray):
+        """Complex coefficients of (n_epochs, n_chans, n_times) X, tile by tile
+
+        Yields (epochs, chan, freqs, out_times, coefs); coefs is
+        (n_tile_epochs, n_tile_freqs, n_tile_times_out) and is only valid
+        until the next tile is requested.
+        """
+        n_epochs, n_chans, n_times = X.shape
+        block = self._time_block(n_times)
+        nfft = self._nfft(min(block, n_times))
+        bank = self._bank(nfft)
+        n_fold = nfft // self.decim
+        epoch_step, freq_step = self._tile_shape(n_epochs, nfft)
+
+        for start in range(0, n_times, block):
+            stop = min(start + block, n_times)
+            seg_start = max(start - self.pad, 0)
+            seg_stop = min(stop + self.pad, n_times)
+            spectra = fft(X[..., seg_start:seg_stop], nfft, axis=-1)
+            offset = (start - seg_start) // self.decim
+            n_block_out = -(-(stop - start) // self.decim)
+            out_times = slice(start // self.decim, start // self.decim + n_block_out)
+            for chan in range(n_chans):
+                for e0 in range(0, n_epochs, epoch_step):
+                    epochs = slice(e0, min(e0 + epoch_step, n_epochs))
+                    for f0 in range(0, len(self.freqs), freq_step):
+                        freqs = slice(f0, min(f0 + freq_step, len(self.freqs)))
+                        product = spectra[epochs, chan, np.newaxis] * bank[freqs]
+                        if self.decim > 1:
+                            # decimating in time == averaging aliased copies of the spectrum
+                            product = product.reshape(
+                                product.shape[0], product.shape[1], self.decim, n_fold
+                            ).mean(axis=2)
+                        coefs = ifft(product, axis=-1, overwrite_x=True)
+                        yield epochs, chan, freqs, out_times, coefs[
+                            ..., offset : offset + n_block_out
+                        ]
+
+    def transform(
+        self,
+        data: np.ndarray,
+        output: str = "avg_power",
+        freq_bands: Optional[Dict[str, List[float]]] = None,
+    ) -> np.ndarray:
+        """Time-frequency transform of (n_epochs, n_chans, n_times) data
+
+        output is "complex", "power" (n_epochs, n_chans, n_freqs, n_times_out)
+        or "avg_power" (n_chans, n_freqs, n_times_out). If freq_bands is given,
+        the frequency axis is collapsed to the mean power within each band.
+        """
+        assert output in ["complex", "power", "avg_power"], f"Unknown output {output}"
+        assert data.ndim == 3, "Input must be (n_epochs, n_chans, n_times)"
+        if freq_bands is not None:
+            assert output != "complex", "Band output requires power"
+            reduce_bands = self.band_matrix(freq_bands).astype(self.dtype)
+
+        n_epochs, n_chans, n_times = data.shape
+        n_out = -(-n_times // self.decim)
+        n_rows = len(self.freqs) if freq_bands is None else len(freq_bands)
+        if output == "avg_power":
+            result = np.zeros((n_chans, n_rows, n_out), dtype=np.float64)
+        elif output == "complex":
+            result = np.empty((n_epochs, n_chans, n_rows, n_out), dtype=self.complex_dtype)
+        else:
+            alloc = np.empty if freq_bands is None else np.zeros
+            result = alloc((n_epochs, n_chans, n_rows, n_out), dtype=self.dtype)
+
+        # channel chunks hold every epoch of a channel and fit chunk_bytes of spectra
+        nfft = self._nfft(min(self._time_block(n_times), n_times))
+        chans_per_chunk = max(
+            1, self.chunk_bytes // (n_epochs * nfft * self.complex_dtype.itemsize)
+        )
+        for c0 in range(0, n_chans, chans_per_chunk):
+            X = np.asarray(data[:, c0 : c0 + chans_per_chunk], dtype=self.dtype)
+            for epochs, chan, freqs, out_times, coefs in self._cwt_tiles(X):
+                chan += c0
+                if output == "complex":
+                    result[epochs, chan, freqs, out_times] = coefs
+                    continue
+
+                power = coefs.real**2
+                power += coefs.imag**2
+                rows = freqs
+                if freq_bands is not None:
+                    # band means are linear, so each freq tile adds its share
+                    power = np.einsum("bf,eft->ebt", reduce_bands[:, freqs], power)
+                    rows = slice(None)
+                if output == "avg_power":
+                    result[chan, rows, out_times] += power.sum(axis=0, dtype=np.float64)
+                elif freq_bands is not None:
+                    result[epochs, chan, :, out_times] += power
+                else:
+                    result[epochs, chan, freqs, out_times] = power
+        if output == "avg_power":
+            result /= n_epochs
+            result = result.astype(self.dtype, copy=False)
+        return result
+
+    def band_matrix(self, freq_bands: Dict[str, List[float]]) -> np.ndarray:
+        return band_matrix(self.freqs, freq_bands)
+
+
+def band_matrix(freqs: np.ndarray, freq_bands: Dict[str, List[float]]) -> np.ndarray:
+    """(n_bands, n_freqs) matrix averaging the frequencies inside each band"""
+    matrix = np.zeros((len(freq_bands), len(freqs)))
+    for i, (band, (fmin, fmax)) in enumerate(freq_bands.items()):
+        in_band = (freqs >= fmin) & (freqs <= fmax)
+        assert in_band.any(), f"No frequencies inside band {band} ({fmin}-{fmax} Hz)"
+        matrix[i, in_band] = 1.0 / in_band.sum()
+    return matrix
+
+
+def tfr_array_morlet_fft(
+    data: np.ndarray,
+    sfreq: float,
+    freqs: np.ndarray,
+    n_cycles: Union[float, np.ndarray],
+    output: str = "avg_power",
+    decim: int = 1,
+    zero_mean: bool = False,
+    freq_bands: Optional[Dict[str, List[float]]] = None,
+    dtype=np.float64,
+) -> np.ndarray:
+    """Drop-in counterpart of mne.time_frequency.tfr_array_morlet"""
+    engine = MorletTFR(sfreq, freqs, n_cycles, decim=decim, zero_mean=zero_mean, dtype=dtype)
+    return engine.transform(data, output=output, freq_bands=freq_bands)
+
+
+def baseline_slice(times: np.ndarray, baseline: Tuple[float, float]) -> slice:
+    """Samples inside (bmin, bmax), selected as mne.baseline.rescale does"""
+    bmin, bmax = baseline
+    imin = 0 if bmin is None else int(np.flatnonzero(times >= bmin)[0])
+    imax = len(times) if bmax is None else int(np.flatnonzero(times <= bmax)[-1]) + 1
+    assert imin < imax, f"Empty baseline {baseline} for times [{times[0]}, {times[-1]}]"
+    return slice(imin, imax)
+
+
+def zscore_tfr(
+    power: np.ndarray,
+    times: np.ndarray,
+    baseline: Tuple[float, float],
+    time_range: Optional[Tuple[float, float]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Baseline z-score a (n_rois, n_freqs, n_times) power tensor for every ROI at once
+
+    Same as tfr.plot(mode="zscore") per ROI, then cropped to time_range.
+    Leading axes (e.g. subjects) are z-scored independently.
+    Returns the z-scored tensor and its times.
+    """
+    base = power[..., baseline_slice(times, baseline)]
+    zpower = (power - base.mean(axis=-1, keepdims=True)) / base.std(axis=-1, keepdims=True)
+    if time_range is not None:
+        keep = (times >= time_range[0]) & (times <= time_range[1])
+        zpower, times = zpower[..., keep], times[keep]
+    return zpower, times
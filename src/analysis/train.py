@@ -0,0 +1,177 @@
+import logging
+import os
+import pickle
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, roc_auc_score
+from sklearn.model_selection import StratifiedGroupKFold
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from typing import Dict, List, Optional, Tuple
+
+from src.configs.config import CFGLog
+from src.utils.config import Config
+from src.utils.registry import registry
+
+logger = logging.getLogger(__name__)
+
+# positive vs negative class, as defined by the Subject groups
+COMPARISONS = {
+    "CP_vs_HC": ("CP", "HC"),
+    "WSP_vs_LP": ("WSP", "LP"),
+}
+
+# LogisticRegression solvers that start from the previous coefficients when
+# warm_start is set; liblinear always starts from scratch
+WARM_START_SOLVERS = ("lbfgs", "newton-cg", "newton-cholesky", "sag", "saga")
+
+
+def make_estimator(cfg: Config):
+    train = cfg.train
+    return make_pipeline(
+        StandardScaler(),
+        LogisticRegression(
+            solver=train.solver,
+            penalty=train.penalty,
+            C=train.C,
+            max_iter=train.max_iter,
+            random_state=train.random_state,
+            # reuses the previous coefficients along the C path
+            warm_start=train.solver in WARM_START_SOLVERS,
+        ),
+    )
+
+
+def make_labels(
+    subject_ids: List[str],
+    comparison: str,
+    study: str = "chronic_low_back_pain",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Row indices into subject_ids and binary labels for a group comparison"""
+    positive, negative = COMPARISONS[comparison]
+    rows, labels = [], []
+    for row, sub_id in enumerate(subject_ids):
+        in_positive = registry.in_group(sub_id, positive, study)
+        in_negative = registry.in_group(sub_id, negative, study)
+        assert not (in_positive and in_negative), f"{sub_id} is in both {positive} and {negative}"
+        if in_positive or in_negative:
+            rows.append(row)
+            labels.append(int(in_positive))
+    return np.array(rows, dtype=int), np.array(labels, dtype=int)
+
+
+def _fit_path(estimator, X, y, train_ids, test_ids, C_grid) -> np.ndarray:
+    # one fold, walking the C grid from strongest to weakest regularization
+    estimator = clone(estimator)
+    scores = np.empty((len(C_grid), 2))
+    for i, C in enumerate(C_grid):
+        estimator.set_params(logisticregression__C=C)
+        estimator.fit(X[train_ids], y[train_ids])
+        proba = estimator.predict_proba(X[test_ids])[:, 1]
+        scores[i, 0] = accuracy_score(y[test_ids], proba > 0.5)
+        scores[i, 1] = (
+            roc_auc_score(y[test_ids], proba)
+            if len(np.unique(y[test_ids])) == 2
+            else np.nan
+        )
+    return scores
+
+
+def cross_validate(
+    cfg: Config,
+    X: np.ndarray,
+    y: np.ndarray,
+    groups: np.ndarray,
+    C_grid: List[float],
+    n_splits: int = 5,
+    n_jobs: int = 1,
+) -> Dict[str, np.ndarray]:
+    """Stratified, subject-grouped CV over a C grid, run in parallel
+
+    With a warm-starting solver each worker walks the C grid of one fold;
+    otherwise every (fold, C) pair is its own task. Returns accuracy and ROC
+    AUC arrays of shape (n_splits, n_C).
+    """
+    C_grid = np.sort(np.asarray(C_grid, dtype=float))
+    cv = StratifiedGroupKFold(
+        n_splits=n_splits, shuffle=True, random_state=cfg.train.random_state
+    )
+    folds = list(cv.split(X, y, groups))
+
+    if cfg.train.solver in WARM_START_SOLVERS:
+        paths = [(train_ids, test_ids, C_grid) for train_ids, test_ids in folds]
+    else:
+        # nothing carries over between Cs, so split the grid across workers too
+        paths = [(train_ids, test_ids, [C]) for train_ids, test_ids in folds for C in C_grid]
+
+    # X is memory-mapped into the workers once rather than copied per task
+    scores = Parallel(n_jobs=n_jobs, max_nbytes="1M", mmap_mode="r")(
+        delayed(_fit_path)(make_estimator(cfg), X, y, train_ids, test_ids, path_C)
+        for train_ids, test_ids, path_C in paths
+    )
+    scores = np.concatenate(scores).reshape(len(folds), len(C_grid), 2)
+    return {"C": C_grid, "accuracy": scores[..., 0], "roc_auc": scores[..., 1]}
+
+
+def train_model(
+    features: np.ndarray,
+    subject_ids: List[str],
+    comparison: str = "CP_vs_HC",
+    C_grid: Optional[List[float]] = None,
+    n_splits: int = 5,
+    n_jobs: int = 1,
+    cfg: Optional[Config] = None,
+    export: bool = True,
+):
+    """Cross-validate a C grid for one comparison, refit the best C and export it
+
+    features is (n_subjects, ...) aligned with subject_ids, e.g. the band-power
+    table from src.analysis.feature_extraction.
+    """
+    cfg = Config.from_json(CFGLog) if cfg is None else cfg
+    C_grid = np.logspace(-4, 2, 13) if C_grid is None else C_grid
+
+    rows, y = make_labels(subject_ids, comparison)
+    X = np.ascontiguousarray(features[rows].reshape(len(rows), -1))
+    groups = np.asarray(subject_ids)[rows]
+    logger.info(
+        "%s: %d vs %d subjects, %d features", comparison, y.sum(), len(y) - y.sum(), X.shape[1]
+    )
+
+    cv_results = cross_validate(cfg, X, y, groups, C_grid, n_splits, n_jobs)
+    best = int(np.nanargmax(np.nanmean(cv_results["roc_auc"], axis=0)))
+    best_C = cv_results["C"][best]
+    logger.info(
+        "Best C=%g: AUC %.3f, accuracy %.3f",
+        best_C,
+        np.nanmean(cv_results["roc_auc"][:, best]),
+        np.mean(cv_results["accuracy"][:, best]),
+    )
+
+    model = make_estimator(cfg).set_params(logisticregression__C=best_C).fit(X, y)
+    if export:
+        os.makedirs(cfg.output.output_path, exist_ok=True)
+        model_fname = os.path.join(cfg.output.output_path, cfg.output.model_name)
+        with open(model_fname, "wb") as f:
+            pickle.dump(model, f)
+        logger.info("Exported model to %s", model_fname)
+    return model, cv_results
+
+
+def train_all(
+    features: np.ndarray,
+    subject_ids: List[str],
+    C_grid: Optional[List[float]] = None,
+    n_splits: int = 5,
+    n_jobs: int = 1,
+    cfg: Optional[Config] = None,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """Cross-validation results for every comparison, without exporting"""
+    return {
+        comparison: train_model(
+            features, subject_ids, comparison, C_grid, n_splits, n_jobs, cfg, export=False
+        )[1]
+        for comparison in COMPARISONS
+    }
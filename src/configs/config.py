@@ -111,6 +111,8 @@ CFGLog = {
     
     "data_info": {
         "sfreq": 600,
+        # "float32" keeps loaded arrays and TFRs in float32/complex64
+        "precision": "float64",
         "roi_names": [# Left
              'rostralanteriorcingulate-lh', # Left Rostral ACC
              'caudalanteriorcingulate-lh', # Left Caudal ACC
@@ -124,7 +126,7 @@ CFGLog = {
              'insula-rh', 'superiorfrontal-rh', # Right Insula, Right DL-PFC
              'medialorbitofrontal-rh', # Right Medial-OFC",
             ],
-        "roi_acronyms": ["L_rACC", "R_dACC", 
+        "roi_acronyms": ["L_rACC", "L_dACC", 
                          "L_S1", "L_Ins", 
                          "L_dlPFC", "L_mOFC",
                          "R_rACC", "R_dACC",
@@ -0,0 +1,173 @@
+import argparse
+import logging
+import os
+
+from src.configs.config import CFGLog
+
+
+def score(args):
+    from src.analysis.predict import BatchScorer, subject_ids_from_dir
+    from src.preprocessing.processor import SubjectProcessor
+
+    zscored_epochs_data_path = args.recordings_dir or args.zscored_epochs_data_path
+    paths_dict = {
+        "processed_data_path": args.processed_data_path,
+        "stc_path": args.stc_path,
+        "EO_resting_data_path": args.EO_resting_data_path,
+        "zscored_epochs_data_path": zscored_epochs_data_path,
+    }
+    processor = SubjectProcessor(
+        paths_dict,
+        CFGLog["data_info"]["roi_acronyms"],
+        precision=CFGLog["data_info"].get("precision", "float64"),
+    )
+
+    subject_ids = args.subjects or subject_ids_from_dir(zscored_epochs_data_path)
+    print(f"Scoring {len(subject_ids)} subjects...")
+
+    model_fname = args.model or os.path.join(
+        CFGLog["output"]["output_path"], CFGLog["output"]["model_name"]
+    )
+    scorer = BatchScorer(
+        model_fname,
+        processor,
+        CFGLog["data_info"]["freq_bands"],
+        args.features_path,
+        n_jobs=args.n_jobs,
+    )
+    scorer.score(subject_ids, args.output)
+    print(f"Saved scores to {args.output}")
+
+
+def preprocess(args):
+    from eeg_toolkit import preprocess as eeg_preprocess
+    from src.preprocessing.runner import PipelineRunner, default_stages
+
+    times_tup, time_win_path = eeg_preprocess.get_time_window(args.time_window)
+    stages = default_stages(
+        args.data_dir,
+        times_tup,
+        CFGLog["data_info"]["roi_names"],
+        include_noise=args.include_noise,
+        method=args.method,
+        time_win_path=time_win_path,
+    )
+    if args.stages:
+        stages = [stage for stage in stages if stage.name in args.stages]
+
+    runner = PipelineRunner(
+        stages,
+        state_path=os.path.join(args.data_dir, ".pipeline_state"),
+        n_jobs=args.n_jobs,
+        blas_threads=args.blas_threads,
+    )
+    runner.run(args.subjects, force=args.force)
+
+
+def benchmark(args):
+    import json
+    import sys
+    from src.utils.benchmark import compare, run_benchmarks
+
+    results = run_benchmarks(
+        args.scales,
+        args.output,
+        repeats=args.repeats,
+        n_jobs=args.n_jobs,
+        work_dir=args.work_dir,
+        precision=args.precision,
+    )
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions against {args.baseline}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="High-Pain-Cross-Study-EEG batch jobs")
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("--trace", help="Append per-stage timing spans to this JSON-lines file")
+    parser.add_argument(
+        "--trace-malloc", action="store_true", help="Also record peak Python allocations per span"
+    )
+    parser.add_argument("--chrome-trace", help="Convert the spans to a Chrome trace file at exit")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = subparsers.add_parser(
+        "score", help="Score subjects with the exported model"
+    )
+    score_parser.add_argument("--subjects", nargs="+", help="Subject IDs to score")
+    score_parser.add_argument(
+        "--recordings-dir", help="Score every *_epochs.pkl recording in this directory"
+    )
+    score_parser.add_argument("--processed-data-path", required=True)
+    score_parser.add_argument("--zscored-epochs-data-path")
+    score_parser.add_argument("--stc-path", default=".")
+    score_parser.add_argument("--EO-resting-data-path", default=".")
+    score_parser.add_argument("--features-path", default="./data/features")
+    score_parser.add_argument("--model", help="Defaults to CFGLog output_path/model_name")
+    score_parser.add_argument("--output", default="./data/scores.csv")
+    score_parser.add_argument("--n-jobs", type=int, default=1)
+    score_parser.set_defaults(func=score)
+
+    preprocess_parser = subparsers.add_parser(
+        "preprocess", help="Run (or resume) per-subject preprocessing stages"
+    )
+    preprocess_parser.add_argument("--data-dir", required=True)
+    preprocess_parser.add_argument("--subjects", nargs="+", required=True)
+    preprocess_parser.add_argument(
+        "--stages", nargs="+", choices=["raw", "resting", "epochs", "source"]
+    )
+    preprocess_parser.add_argument("--time-window", type=float, default=5)
+    preprocess_parser.add_argument("--method", default="MNE")
+    preprocess_parser.add_argument("--include-noise", action="store_true")
+    preprocess_parser.add_argument("--n-jobs", type=int, default=1)
+    preprocess_parser.add_argument(
+        "--blas-threads", type=int, default=1, help="BLAS/OpenMP threads per worker"
+    )
+    preprocess_parser.add_argument(
+        "--force", action="store_true", help="Rerun stages even if up to date"
+    )
+    preprocess_parser.set_defaults(func=preprocess)
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark", help="Time loaders, TFR and plotting on synthetic cohorts"
+    )
+    benchmark_parser.add_argument(
+        "--scales", nargs="+", default=["small", "medium"], choices=["small", "medium", "large"]
+    )
+    benchmark_parser.add_argument("--output", help="Save results as JSON")
+    benchmark_parser.add_argument("--baseline", help="Compare against a saved results JSON")
+    benchmark_parser.add_argument("--time-tolerance", type=float, default=1.25)
+    benchmark_parser.add_argument("--memory-tolerance", type=float, default=1.25)
+    benchmark_parser.add_argument("--repeats", type=int, default=3)
+    benchmark_parser.add_argument("--n-jobs", type=int, default=1)
+    benchmark_parser.add_argument("--work-dir", help="Where the synthetic cohorts are written")
+    benchmark_parser.add_argument("--precision", default="float64", choices=["float64", "float32"])
+    benchmark_parser.set_defaults(func=benchmark)
+
+    args = parser.parse_args(argv)
+    if args.command == "score" and not (args.recordings_dir or args.zscored_epochs_data_path):
+        parser.error("score needs --recordings-dir or --zscored-epochs-data-path")
+    if args.chrome_trace and not args.trace:
+        parser.error("--chrome-trace needs --trace")
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(name)s: %(message)s")
+    if args.trace:
+        from src.utils.profiling import to_chrome_trace, tracer
+
+        tracer.enable(args.trace, trace_malloc=args.trace_malloc)
+    try:
+        args.func(args)
+    finally:
+        if args.chrome_trace:
+            to_chrome_trace(args.trace, args.chrome_trace)
+            print(f"Wrote {args.chrome_trace}")
+
+
+if __name__ == "__main__":
+    main()
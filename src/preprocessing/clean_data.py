@@ -0,0 +1,161 @@
+import numpy as np
+from typing import List, Sequence, Tuple
+
+# stimulus codes from the custom annotation mapping
+HAND_BACK_STIM_CODES = (3, 4, 5, 6, 7, 8)  # yes/med/no pain, hand and back
+KEY_PRESS_CODES = (10, 11, 12, 13)  # pen tip down/up, lesser/greater weight
+PEN_DOWN_CODES = (10, 12)
+PEN_UP_CODES = (11, 13)
+
+
+def find_merged_events(events: np.ndarray) -> np.ndarray:
+    """Indices of events to drop where two consecutive events share a sample
+
+    Events are (sample, 0, code) rows. Of each same-sample pair, the event after
+    a stimulus code (< 10) is dropped; otherwise the first one is dropped if the
+    second is a stimulus code.
+    """
+    events = np.asarray(events)
+    same_sample = events[:-1, 0] == events[1:, 0]
+    curr_is_stim = events[:-1, 2] < 10
+    next_is_stim = events[1:, 2] < 10
+
+    drop_next = same_sample & curr_is_stim
+    drop_curr = same_sample & ~curr_is_stim & next_is_stim
+    return np.union1d(np.flatnonzero(drop_next) + 1, np.flatnonzero(drop_curr))
+
+
+def drop_merged_events(events: np.ndarray, verbose: bool = True) -> np.ndarray:
+    drop_ids = find_merged_events(events)
+    if verbose and len(drop_ids):
+        print(f"Found {len(drop_ids)} merged events. Deleting events at indices {drop_ids.tolist()}.")
+    return np.delete(events, drop_ids, axis=0)
+
+
+def find_repeated_events(
+    events: np.ndarray,
+    sfreq: float = 400,
+    max_gap_ms: float = 1000,
+    codes: Sequence[int] = (3, 4, 5, 6, 7),
+) -> np.ndarray:
+    """Indices of repeated key presses
+
+    An event is a repeat if it and the next event carry the same stimulus code,
+    are less than max_gap_ms apart, and the event after that has the same code
+    too. The later event is kept, so the returned indices are the ones to drop.
+    """
+    events = np.asarray(events)
+    if len(events) < 3:
+        return np.array([], dtype=int)
+    code = events[:, 2]
+    is_stim = np.isin(code, codes)
+    gap = np.diff(events[:, 0])
+
+    repeated = (
+        is_stim[:-2]
+        & is_stim[1:-1]
+        & (gap[:-1] < max_gap_ms * sfreq / 1000)
+        & (code[:-2] == code[1:-1])
+        & (code[2:] == code[1:-1])
+    )
+    return np.flatnonzero(repeated)
+
+
+def drop_repeated_events(
+    events: np.ndarray, sfreq: float = 400, verbose: bool = True
+) -> np.ndarray:
+    """Events without the repeats found by find_repeated_events
+
+    Unlike the notebook, which only reports and counts the repeats (its
+    np.delete is commented out), this removes them. Use find_repeated_events
+    to reproduce the notebook's behaviour.
+    """
+    drop_ids = find_repeated_events(events, sfreq)
+    if verbose and len(drop_ids):
+        print(f"Removed {len(drop_ids)} repeated key presses at indices {drop_ids.tolist()}.")
+    return np.delete(events, drop_ids, axis=0)
+
+
+def _key_lookup(val_list: List[int], key_list: List[str]) -> np.ndarray:
+    # code -> first annotation key with that code (what val_list.index gives)
+    lookup = np.empty(max(val_list) + 1, dtype=object)
+    for val, key in zip(reversed(val_list), reversed(key_list)):
+        lookup[val] = key
+    return lookup
+
+
+def get_stim_epochs(
+    epochs,
+    val_list: List[int],
+    key_list: List[str],
+    events_from_annot_drop_repeats_list,
+    min_dur_stim: float,
+    max_dur_stim: float,
+    gap_ITI: float,
+    sfreq: float = 400,
+) -> Tuple[list, list, list, list, list, list, list, list]:
+    """Vectorized version of the preprocessing notebook's get_stim_epochs
+
+    Returns the same lists (stim_labels, StimOn_ids, key_wo_pp_ids,
+    key_wo_pp_lbls, key_wo_pp_samps_to_ms, key_to_pp_lag, pp_updown_dur,
+    ITI_stim_gap), computed with lookup tables and shifted comparisons.
+    """
+    ms_to_samp = sfreq / 1000
+    samps_to_ms = 1000 / sfreq
+
+    events = np.asarray(events_from_annot_drop_repeats_list)
+    ids = np.arange(len(epochs) - 1)
+    samples = events[:, 0]
+    curr_val = events[ids, 2]
+    next_val = events[ids + 1, 2]
+    curr_key = _key_lookup(val_list, key_list)[curr_val]
+    next_gap = samples[ids + 1] - samples[ids]
+    prev_gap = samples[ids] - samples[ids - 1]  # wraps to the last event for i = 0
+
+    curr_is_stim = np.isin(curr_val, HAND_BACK_STIM_CODES)
+    next_is_key = np.isin(next_val, KEY_PRESS_CODES)
+    stim_labels, StimOn_ids = [], []
+    key_wo_pp_ids, key_wo_pp_lbls, key_wo_pp_samps_to_ms = [], [], []
+    key_to_pp_lag, pp_updown_dur, ITI_stim_gap = [], [], []
+
+    # for paradigms with NS, LS, HS pinprick markers AND key presses
+    if (10 in val_list or 12 in val_list) and 3 in val_list:
+        with_pp = curr_is_stim & next_is_key
+        StimOn_ids = (ids[with_pp] + 1).tolist()
+        stim_labels = curr_key[with_pp].tolist()
+        key_to_pp_lag = (next_gap[with_pp] * samps_to_ms).tolist()
+
+        # key presses without a following pinprick marker
+        wo_pp = curr_is_stim & ~next_is_key
+        key_wo_pp_ids = ids[wo_pp].tolist()
+        key_wo_pp_lbls = curr_key[wo_pp].tolist()
+        key_wo_pp_samps_to_ms = (samples[ids[wo_pp]] * samps_to_ms).tolist()
+
+    # for paradigms with NS and HS, no LS. Key presses but no pinprick markers
+    elif 10 not in val_list or 12 not in val_list:
+        StimOn_ids = ids[curr_is_stim].tolist()
+        stim_labels = curr_key[curr_is_stim].tolist()
+
+    # for data missing all key presses, but has pinprick markers:
+    # pen down followed by pen up within (min_dur_stim, max_dur_stim) ms
+    elif 3 not in val_list:
+        pp = (
+            np.isin(curr_val, PEN_DOWN_CODES)
+            & np.isin(next_val, PEN_UP_CODES)
+            & (next_gap > float(min_dur_stim * ms_to_samp))
+            & (next_gap < float(max_dur_stim * ms_to_samp))
+        )
+        StimOn_ids = ids[pp].tolist()
+        pp_updown_dur = (next_gap[pp] * samps_to_ms).tolist()
+        ITI_stim_gap = (prev_gap[pp] * samps_to_ms).tolist()
+
+    return (
+        stim_labels,
+        StimOn_ids,
+        key_wo_pp_ids,
+        key_wo_pp_lbls,
+        key_wo_pp_samps_to_ms,
+        key_to_pp_lag,
+        pp_updown_dur,
+        ITI_stim_gap,
+    )
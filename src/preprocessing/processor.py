@@ -1,104 +1,37 @@
-from glob import glob
+import logging
 import pickle
-import scipy.io as sio
 import numpy as np
-import matplotlib.pyplot as plt
-import mne
 import os
-from mne.time_frequency import tfr_array_morlet, AverageTFRArray
-import seaborn as sns
 from typing import Dict, List, Union
-from IPython.display import clear_output
+from joblib import Parallel, delayed
 
-sns.set(style="white", font_scale=1.5)
+from src.analysis.spectral import RestingSpectrum, welch_stream
+from src.configs.config import CFGLog
+from src.preprocessing.standardize_data import standardize_subject
+from src.utils.accumulators import RunningMoments
+from src.utils.config import get_dtype
+from src.utils.data_validation import DataValidator
+from src.utils.file_handling import ArrayStore
+from src.utils.montage import montage_64
+from src.utils.profiling import span, traced
+from src.utils.registry import FileCatalog, registry
+
+# mne, scipy.io and the scipy.fft-based TFR module are imported inside the
+# methods that need them, so loading arrays from the cache (e.g. in pool
+# workers) does not pay for them
+logger = logging.getLogger(__name__)
 
 
 class Subject:
-    def __init__(self, subject_id: str):
+    def __init__(self, subject_id: str, study: str = None):
         assert isinstance(subject_id, str), "Subject ID must be a string"
         self.subject_id = subject_id
         self.response = None
 
-        sub_ids = {
-            "CP": [
-                "018",
-                "022",
-                "024",
-                "031",
-                "032",
-                "034",
-                "036",
-                "039",
-                "040",
-                "045",
-                "046",
-                "052",
-                "020",
-                "021",
-                "023",
-                "029",
-                "037",
-                "041",
-                "042",
-                "044",
-                "048",
-                "049",
-                "050",
-                "056",
-            ],
-            "HC": [
-                "C10",
-                "C11",
-                "C12",
-                "C13",
-                "C14",
-                "C15",
-                "C16",
-                "C17",
-                "C18",
-                "C19",
-                "C2.",
-                "C24",
-                "C25",
-                "C26",
-                "C27",
-                "C3.",
-                "C6.",
-                "C7.",
-                "C9.",
-            ],
-            "WSP": [
-                "018",
-                "022",
-                "024",
-                "031",
-                "032",
-                "034",
-                "036",
-                "039",
-                "040",
-                "045",
-                "046",
-                "052",
-            ],
-            "LP": [
-                "020",
-                "021",
-                "023",
-                "029",
-                "044",
-                "037",
-                "041",
-                "042",
-                "048",
-                "049",
-                "050",
-                "056",
-            ],
-        }
-
-        # Assign group from sub_ids dict keys if sub_id is in any of the keys
-        self.group = next((key for key in sub_ids if subject_id in sub_ids[key]), None)
+        # Assign groups from the subject registry built once from CFGLog;
+        # group is the first match (e.g. CP for a subject also in WSP)
+        self.groups = registry.groups(subject_id, study)
+        self.group = self.groups[0] if self.groups else None
 
     def __str__(self):
         return f"Subject ID: {self.subject_id}, Group: {self.group}, Response: {self.response}"
@@ -118,7 +51,12 @@ class SubjectGroup:
 
 
 class SubjectProcessor:
-    def __init__(self, paths_dict: Dict[str, str], roi_acronyms: List[str]):
+    def __init__(
+        self,
+        paths_dict: Dict[str, str],
+        roi_acronyms: List[str],
+        precision: str = "float64",
+    ):
         self.yes_list = []
         self.no_list = []
         self.maybe_list = []
@@ -129,133 +67,257 @@ class SubjectProcessor:
         self.stc_path = self.paths_dict["stc_path"]
         self.EO_resting_data_path = self.paths_dict["EO_resting_data_path"]
         self.zscored_epochs_data_path = self.paths_dict["zscored_epochs_data_path"]
+        self.cache_path = self.paths_dict.get(
+            "cache_path", os.path.join(self.processed_data_path, "array_cache")
+        )
+        self.store = ArrayStore(self.cache_path)
+        self.catalog = FileCatalog()
 
         self.sfreq = 400  # Hz
         self.roi_acronyms = roi_acronyms
+        self.trial_block_size = 32  # trials folded into running moments at a time
+        self.montage = montage_64
+        # dtype of cached arrays and returned reductions; reductions still
+        # accumulate in float64 (see RunningMoments)
+        self.dtype = get_dtype(precision)
+
+        # resting-state spectra: Welch segments of resting_nperseg samples
+        # (default 1 s), read resting_chunk_segments segments at a time
+        self.freq_bands = CFGLog["data_info"]["freq_bands"]
+        self.resting_nperseg = None
+        self.resting_chunk_segments = 64
+
+        # STC epochs as loaded: per-ROI z-scored from the cache (over
+        # zscore_baseline, or the whole epoch if None) when zscore_stc is set
+        self.zscore_stc = False
+        self.zscore_baseline = None
+
+    def _cache_name(self, name: str) -> str:
+        # arrays of another precision are cached beside, not over, each other
+        return name if self.dtype == np.float64 else f"{name}_{self.dtype.name}"
 
     def _fill_nan_channels(self, epochs):
-        incomplete_ch_names = epochs.info["ch_names"]
-        complete_ch_names = [
-            "Fp1",
-            "Fpz",
-            "Fp2",
-            "AF3",
-            "AF4",
-            "F11",
-            "F7",
-            "F5",
-            "F3",
-            "F1",
-            "Fz",
-            "F2",
-            "F4",
-            "F6",
-            "F8",
-            "F12",
-            "FT11",
-            "FC5",
-            "FC3",
-            "FC1",
-            "FCz",
-            "FC2",
-            "FC4",
-            "FC6",
-            "FT12",
-            "T7",
-            "C5",
-            "C3",
-            "C1",
-            "Cz",
-            "C2",
-            "C4",
-            "C6",
-            "T8",
-            "TP7",
-            "CP5",
-            "CP3",
-            "CP1",
-            "CPz",
-            "CP2",
-            "CP4",
-            "CP6",
-            "TP8",
-            "M1",
-            "M2",
-            "P7",
-            "P5",
-            "P3",
-            "P1",
-            "Pz",
-            "P2",
-            "P4",
-            "P6",
-            "P8",
-            "PO7",
-            "PO3",
-            "POz",
-            "PO4",
-            "PO8",
-            "O1",
-            "Oz",
-            "O2",
-            "Cb1",
-            "Cb2",
-        ]
-        complete_ch_names = [ch_name.upper() for ch_name in complete_ch_names]
-        missing_ch_ids = [
-            i
-            for i in range(len(complete_ch_names))
-            if complete_ch_names[i] not in incomplete_ch_names
-        ]
-
-        data = epochs.get_data(copy=False)
-        data = np.insert(data, missing_ch_ids, np.nan, axis=1)
+        import mne
 
+        data = self.montage.align(epochs.get_data(copy=False), epochs.info["ch_names"])
         info = mne.create_info(
-            ch_names=complete_ch_names, sfreq=self.sfreq, ch_types="eeg"
+            ch_names=self.montage.ch_names, sfreq=self.sfreq, ch_types="eeg"
         )
-
-        epochs = mne.EpochsArray(data, info)
+        epochs = mne.EpochsArray(data, info, tmin=epochs.tmin, verbose=False)
         return epochs
 
-    def _load_epochs(self, subject_id: str):
-        print(f"\nLoading Epochs for {subject_id}...")
-        epo_fname = glob(f"{self.processed_data_path}/{subject_id}*epo.fif")[0]
+    @traced("read_epochs_fif", subject_arg=None)
+    def _read_epochs_fif(self, epo_fname: str):
+        import mne
+
         epochs = mne.read_epochs(epo_fname)
         assert isinstance(
             epochs, mne.epochs.EpochsFIF
         ), "Input must be an Epochs object"
+        meta = {
+            "ch_names": epochs.info["ch_names"],
+            "sfreq": epochs.info["sfreq"],
+            "times": epochs.times.tolist(),
+        }
+        return epochs.get_data(copy=False).astype(self.dtype, copy=False), meta
+
+    @traced("read_stc_epochs_pkl", subject_arg=None)
+    def _read_stc_epochs_pkl(self, stc_epo_fname: str, stim_fname: str):
+        with open(stc_epo_fname, "rb") as f:
+            stc_epo = pickle.load(f)
+        stim_labels, _ = self._read_stim_labels_mat(stim_fname)
+        assert len(stim_labels) == len(stc_epo), "One stimulus label per STC epoch"
+
+        # trial-major array with a label -> trial index stored beside it
+        label_index = {
+            str(int(label)): np.flatnonzero(stim_labels == label).tolist()
+            for label in np.unique(stim_labels)
+        }
+        return np.array(stc_epo, dtype=self.dtype), {"label_index": label_index}
+
+    def _read_stim_labels_mat(self, stim_fname: str):
+        import scipy.io as sio
+
+        return sio.loadmat(stim_fname)["stim_labels"][0], {}
+
+    def _read_epochs_data(self, subject_id: str):
+        # memory-mapped epochs in their recorded channel layout
+        epo_fname = self.catalog.find(self.processed_data_path, f"{subject_id}*epo.fif")
+        return self.store.load_or_build(
+            subject_id,
+            self._cache_name("epochs"),
+            [epo_fname],
+            lambda: self._read_epochs_fif(epo_fname),
+        )
+
+    @traced("read_epochs")
+    def _read_epochs(self, subject_id: str):
+        # builds the MNE object, only for callers that need one
+        import mne
+
+        data, meta = self._read_epochs_data(subject_id)
+        ch_names = meta["ch_names"]
+        if len(ch_names) < len(self.montage):
+            data = self.montage.align(data, ch_names)
+            ch_names = self.montage.ch_names
+        info = mne.create_info(ch_names=ch_names, sfreq=meta["sfreq"], ch_types="eeg")
+        return mne.EpochsArray(data, info, tmin=meta["times"][0], verbose=False)
+
+    def _trial_moments(self, data: np.ndarray, trial_ids=None) -> RunningMoments:
+        # fold trials in blocks so only one block is ever materialized at a time
+        trial_ids = np.arange(len(data)) if trial_ids is None else trial_ids
+        if len(trial_ids) == 0:
+            # no trials selected: NaN mean/var, as np.nanmean of an empty selection
+            return RunningMoments.empty(data.shape[1:])
+        moments = RunningMoments()
+        for start in range(0, len(trial_ids), self.trial_block_size):
+            moments.update(data[trial_ids[start : start + self.trial_block_size]])
+        return moments
 
-        if len(epochs.info["ch_names"]) < 64:
-            epochs = self._fill_nan_channels(epochs)
-        evoked = np.nanmean(epochs.get_data(copy=False), axis=0)
-        sem = np.nanstd(epochs.get_data(copy=False), axis=0) / np.sqrt(len(epochs))
+    @traced("epoch_reductions")
+    def _epoch_reductions(self, subject_id: str):
+        # reduce over trials in the recorded layout, then scatter the (small)
+        # evoked/SEM arrays into the montage; no full-tensor copy is made
+        data, meta = self._read_epochs_data(subject_id)
+        moments = self._trial_moments(data)
+        evoked = moments.mean.astype(self.dtype)
+        sem = (moments.std() / np.sqrt(len(data))).astype(self.dtype)
+        if len(meta["ch_names"]) < len(self.montage):
+            evoked = self.montage.align(evoked, meta["ch_names"])
+            sem = self.montage.align(sem, meta["ch_names"])
+        return evoked, sem
+
+    def _load_epochs(self, subject_id: str):
+        logger.info("Loading Epochs for %s...", subject_id)
+        evoked, sem = self._epoch_reductions(subject_id)
+        epochs = self._read_epochs(subject_id)
         return epochs, evoked, sem
 
-    def _load_stc_epochs(self, subject_id: str):
-        print(f"Loading STC epochs for {subject_id}...")
-        stc_epo_fname = glob(
-            f"{self.zscored_epochs_data_path}/{subject_id}_epochs.pkl"
-        )[0]
-        stc_epo = pickle.load(open(stc_epo_fname, "rb"))
-        stc_epo = np.array(stc_epo)
+    def _stc_sources(self, subject_id: str) -> List[str]:
+        # source files of the STC epochs cache: the STC pickle and its stimulus labels
+        stc_epo_fname = self.catalog.find(
+            self.zscored_epochs_data_path, f"{subject_id}_epochs.pkl"
+        )
+        stim_fname = self.catalog.find(
+            self.processed_data_path, f"{subject_id}*stim_labels.mat"
+        )
+        return [stc_epo_fname, stim_fname]
+
+    def _read_stc_epochs(self, subject_id: str, zscore: bool = True):
+        # memory-mapped STC epochs; the z-scored copy if zscore_stc is set
+        if zscore and self.zscore_stc:
+            return standardize_subject(
+                self, subject_id, self.zscore_baseline, self.trial_block_size
+            )
+        stc_epo_fname, stim_fname = self._stc_sources(subject_id)
+        return self.store.load_or_build(
+            subject_id,
+            self._cache_name("stc_epochs"),
+            [stc_epo_fname, stim_fname],
+            lambda: self._read_stc_epochs_pkl(stc_epo_fname, stim_fname),
+        )
+
+    def _select_trials(self, manifest: dict, labels) -> np.ndarray:
+        label_index = manifest["label_index"]
+        trial_ids = [np.asarray(label_index.get(str(int(label)), []), dtype=int) for label in labels]
+        if not trial_ids:
+            return np.empty(0, dtype=int)
+        return np.sort(np.concatenate(trial_ids))
+
+    def _load_stc_trials(self, subject_id: str, labels=(3,)):
+        # STC tensor of the trials with the given labels, (n_trials, n_rois, n_times);
+        # only those trials are read from the memory-mapped cache
+        stc_epo, manifest = self._read_stc_epochs(subject_id)
+        return stc_epo[self._select_trials(manifest, labels)]
 
-        stim_fname = glob(f"{self.processed_data_path}/{subject_id}*stim_labels.mat")[0]
-        stim_labels = sio.loadmat(stim_fname)["stim_labels"][0]
+    def _load_stc_epochs(self, subject_id: str, labels=(3,)):
+        logger.info("Loading STC epochs for %s...", subject_id)
+        with span("load_stc_epochs", subject_id=subject_id) as stage:
+            stc_epo, manifest = self._read_stc_epochs(subject_id)
+            trial_ids = self._select_trials(manifest, labels)
+            stage.set(n_trials=len(stc_epo), n_selected=len(trial_ids))
 
-        print(f"Loaded {len(stim_labels)} stimulus labels")
-        print(f"{sum(stim_labels == 3)} hand trials (out of {len(stim_labels)})")
+            logger.info(
+                "%s: %d trials with labels %s (out of %d)",
+                subject_id,
+                len(trial_ids),
+                list(labels),
+                len(stc_epo),
+            )
+            if len(trial_ids) == 0:
+                logger.warning(
+                    "%s: no trials with labels %s; its STC mean is NaN", subject_id, list(labels)
+                )
 
-        stc_epo_array = np.nanmean(
-            stc_epo[stim_labels == 3], axis=0
-        )  # average over hand trials
+            stc_epo_array = self._trial_moments(
+                stc_epo, trial_ids
+            ).mean.astype(self.dtype)  # average over selected (by default hand) trials
 
         assert isinstance(stc_epo_array, np.ndarray), "Input must be an array"
         return stc_epo_array
 
+    def _read_resting_pkl(self, resting_fname: str):
+        with open(resting_fname, "rb") as f:
+            stc_resting = np.asarray(pickle.load(f), dtype=self.dtype)
+        stc_resting = stc_resting.reshape(-1, stc_resting.shape[-1])
+        assert len(stc_resting) == len(self.roi_acronyms), "One resting time course per ROI"
+        return stc_resting, {}
+
+    def _read_resting_stc(self, subject_id: str):
+        # memory-mapped eyes-open resting STC, (n_rois, n_times)
+        resting_fname = self.catalog.find(self.EO_resting_data_path, f"{subject_id}*.pkl")
+        return self.store.load_or_build(
+            subject_id,
+            self._cache_name("eo_resting"),
+            [resting_fname],
+            lambda: self._read_resting_pkl(resting_fname),
+        )
+
+    def _welch_resting(self, subject_id: str):
+        stc_resting, _ = self._read_resting_stc(subject_id)
+        freqs, psd = welch_stream(
+            stc_resting,
+            self.sfreq,
+            self.resting_nperseg,
+            chunk_segments=self.resting_chunk_segments,
+        )
+        return psd, {"freqs": freqs.tolist()}
+
+    @traced("resting_psd")
+    def _resting_psd(self, subject_id: str):
+        # Welch PSD per ROI, streamed over the memory-mapped recording and cached
+        # beside it per segment length; None for subjects without eyes-open resting data
+        try:
+            resting_fname = self.catalog.find(self.EO_resting_data_path, f"{subject_id}*.pkl")
+        except FileNotFoundError:
+            logger.warning("No eyes-open resting data for %s", subject_id)
+            return None
+        nperseg = int(self.sfreq) if self.resting_nperseg is None else self.resting_nperseg
+        psd, manifest = self.store.load_or_build(
+            subject_id,
+            self._cache_name(f"eo_resting_psd_{nperseg}"),
+            [resting_fname],
+            lambda: self._welch_resting(subject_id),
+        )
+        return np.asarray(manifest["freqs"]), psd
+
+    @traced("load_subject")
+    def _load_subject_reductions(self, subject_id: str, labels=(3,), resting: bool = True):
+        # only the small per-subject arrays are sent back from pool workers
+        logger.info("Loading Epochs for %s...", subject_id)
+        evoked, sem = self._epoch_reductions(subject_id)
+        stc_epo_array = self._load_stc_epochs(subject_id, labels)
+        resting_psd = self._resting_psd(subject_id) if resting else None
+        return evoked, sem, stc_epo_array, resting_psd
+
+    @traced("load_complete_data", subject_arg=None)
     def _load_complete_data(
         self,
         subjects: Union[Subject, SubjectGroup],
+        n_jobs: int = 1,
+        labels=(3,),
+        validate: bool = False,
+        resting: bool = True,
     ):
         assert isinstance(subjects, Subject) or isinstance(
             subjects, SubjectGroup
@@ -263,38 +325,56 @@ class SubjectProcessor:
 
         if isinstance(subjects, SubjectGroup):
             subjects_list = [subject for subject in subjects.subjects]
-            print(f"Loading data for {len(subjects_list)} subjects...")
-            print(f"Subjects: {[subject.subject_id for subject in subjects_list]}")
+            logger.info(
+                "Loading data for %d subjects: %s",
+                len(subjects_list),
+                [subject.subject_id for subject in subjects_list],
+            )
         elif isinstance(subjects, Subject):
             subjects_list = [subjects]
 
-        evoked_data_arrays = []
-        sem_epochs_per_sub = []
-        stc_epo_arrays = []
-        stc_resting_arrays = []
-        for subject in subjects_list:
-            this_sub_id = subject.subject_id
-            epochs, evoked, sem = self._load_epochs(this_sub_id)
-            evoked_data_arrays.append(evoked)
-            sem_epochs_per_sub.append(sem)
-
-            stc_epo_array = self._load_stc_epochs(this_sub_id)
-            stc_epo_arrays.append(stc_epo_array)
+        subject_ids = [subject.subject_id for subject in subjects_list]
+        if validate:
+            report = DataValidator(self, labels).validate(subject_ids, n_jobs)
+            if not report["ok"].all():
+                raise ValueError(
+                    f"Data validation failed for {report.index[~report['ok']].tolist()}"
+                )
+        if n_jobs == 1:
+            reductions = (
+                self._load_subject_reductions(sub_id, labels, resting) for sub_id in subject_ids
+            )
+        else:
+            # results are yielded in input order, so group means match the serial path
+            reductions = Parallel(n_jobs=n_jobs, return_as="generator")(
+                delayed(self._load_subject_reductions)(sub_id, labels, resting)
+                for sub_id in subject_ids
+            )
 
-            stc_resting = None
-            stc_resting_arrays.append(stc_resting)
+        # fold each subject in as it arrives; only the small per-subject
+        # evoked/SEM arrays are kept, the STC grand average is a running mean
+        evoked_data_arrays = None
+        sem_epochs_per_sub = None
+        stc_moments = RunningMoments()
+        resting_moments = RunningMoments()
+        resting_psds = [None] * len(subject_ids)
+        for i, (evoked, sem, stc_epo_array, resting_psd) in enumerate(reductions):
+            if evoked_data_arrays is None:
+                evoked_data_arrays = np.empty((len(subject_ids),) + evoked.shape, self.dtype)
+                sem_epochs_per_sub = np.empty((len(subject_ids),) + sem.shape, self.dtype)
+            evoked_data_arrays[i] = evoked
+            sem_epochs_per_sub[i] = sem
+            stc_moments.update(stc_epo_array[np.newaxis])
+            if resting_psd is not None:
+                resting_psds[i] = resting_psd
+                resting_moments.update(resting_psd[1][np.newaxis])
+        epochs = self._read_epochs(subject_ids[-1])
+        stc_resting = self._resting_spectrum(subject_ids, resting_psds, resting_moments)
 
         # combine data across subjects
-        stc_epo_array = np.nanmean(np.array(stc_epo_arrays), axis=0)
+        stc_epo_array = stc_moments.mean.astype(self.dtype)
         if stc_epo_array.ndim != 3:
             stc_epo_array = np.expand_dims(stc_epo_array, axis=0)
-        stc_resting = (
-            np.nanmean(np.array(stc_resting_arrays), axis=0)
-            if stc_resting is not None
-            else None
-        )
-        evoked_data_arrays = np.array(evoked_data_arrays)
-        sem_epochs_per_sub = np.array(sem_epochs_per_sub)
 
         return (
             epochs,
@@ -303,3 +383,25 @@ class SubjectProcessor:
             stc_epo_array,
             stc_resting,
         )
+
+    def _resting_spectrum(self, subject_ids, resting_psds, resting_moments):
+        # group mean PSD and per-subject band power; None if no subject has resting data
+        if resting_moments.count is None:
+            return None
+        from src.analysis.tfr import band_matrix
+
+        freqs = next(psd[0] for psd in resting_psds if psd is not None)
+        reduce_bands = band_matrix(freqs, self.freq_bands)
+        band_power = np.full(
+            (len(subject_ids), len(self.roi_acronyms), len(self.freq_bands)), np.nan, self.dtype
+        )
+        for i, resting_psd in enumerate(resting_psds):
+            if resting_psd is not None:
+                band_power[i] = resting_psd[1] @ reduce_bands.T
+        return RestingSpectrum(
+            freqs,
+            resting_moments.mean.astype(self.dtype),
+            band_power,
+            self.freq_bands,
+            subject_ids,
+        )
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import traceback
+from glob import glob
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class Stage:
+    """One per-subject preprocessing step with declared inputs and outputs
+
+    inputs and outputs are path templates formatted with sub_id (glob patterns
+    allowed); func is called as func(sub_id, **params).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        inputs: List[str],
+        outputs: List[str],
+        params: Optional[Dict] = None,
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.params = params or {}
+
+    @property
+    def params_hash(self) -> str:
+        params = json.dumps(self.params, sort_keys=True, default=str)
+        return hashlib.sha1(params.encode()).hexdigest()
+
+    def resolve(self, templates: List[str], sub_id: str) -> List[List[str]]:
+        return [sorted(glob(str(template).format(sub_id=sub_id))) for template in templates]
+
+    def __str__(self):
+        return f"Stage: {self.name}, Inputs: {self.inputs}, Outputs: {self.outputs}"
+
+
+class PipelineRunner:
+    """Runs stages for many subjects, skipping up-to-date work and resuming after crashes
+
+    A stage is skipped for a subject when every output exists, is newer than
+    every input, and the stage parameters match those of its last successful
+    run. Outputs with no recorded run (e.g. from before the runner was used on
+    a data tree) are adopted as up to date when they are newer than their
+    inputs. Progress is recorded per subject in state_path, so an interrupted
+    run picks up where it stopped. Subjects run in a process pool, each worker
+    limited to blas_threads BLAS/OpenMP threads.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        state_path: str,
+        n_jobs: int = 1,
+        blas_threads: int = 1,
+    ):
+        self.stages = stages
+        self.state_path = str(state_path)
+        self.n_jobs = n_jobs
+        self.blas_threads = blas_threads
+        os.makedirs(self.state_path, exist_ok=True)
+
+    def _state_fname(self, sub_id: str) -> str:
+        return os.path.join(self.state_path, f"{sub_id}.json")
+
+    def _read_state(self, sub_id: str) -> Dict:
+        try:
+            with open(self._state_fname(sub_id), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_state(self, sub_id: str, state: Dict):
+        tmp_fname = f"{self._state_fname(sub_id)}.tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_fname, self._state_fname(sub_id))
+
+    def is_up_to_date(self, stage: Stage, sub_id: str, state: Dict) -> bool:
+        # a stage never run by the runner has no record; its outputs are judged by mtime
+        record = state.get(stage.name)
+        if record is not None and record.get("params_hash") != stage.params_hash:
+            return False
+        outputs = stage.resolve(stage.outputs, sub_id)
+        if not all(outputs):
+            return False
+        inputs = [fname for matches in stage.resolve(stage.inputs, sub_id) for fname in matches]
+        newest_input = max((os.path.getmtime(f) for f in inputs), default=0.0)
+        oldest_output = min(os.path.getmtime(f) for matches in outputs for f in matches)
+        return oldest_output >= newest_input
+
+    def run_subject(self, sub_id: str, force: bool = False) -> Dict:
+        state = self._read_state(sub_id)
+        with threadpool_limits(limits=self.blas_threads):
+            for stage in self.stages:
+                if not force and self.is_up_to_date(stage, sub_id, state):
+                    if stage.name not in state:
+                        logger.info("%s: adopting existing %s outputs", sub_id, stage.name)
+                        state[stage.name] = {
+                            "status": "done",
+                            "params_hash": stage.params_hash,
+                            "adopted": True,
+                        }
+                        self._write_state(sub_id, state)
+                    else:
+                        logger.info("%s: %s up to date", sub_id, stage.name)
+                    continue
+
+                missing = [
+                    template
+                    for template, matches in zip(stage.inputs, stage.resolve(stage.inputs, sub_id))
+                    if not matches
+                ]
+                if missing:
+                    state[stage.name] = {"status": "missing_inputs", "missing": missing}
+                    self._write_state(sub_id, state)
+                    logger.warning("%s: %s missing inputs %s", sub_id, stage.name, missing)
+                    break
+
+                logger.info("%s: running %s", sub_id, stage.name)
+                start = time.perf_counter()
+                try:
+                    stage.func(sub_id, **stage.params)
+                except Exception:
+                    error = traceback.format_exc()
+                    state[stage.name] = {"status": "failed", "error": error}
+                    self._write_state(sub_id, state)
+                    logger.warning("%s: %s failed\n%s", sub_id, stage.name, error.rstrip())
+                    break
+
+                state[stage.name] = {
+                    "status": "done",
+                    "params_hash": stage.params_hash,
+                    "seconds": time.perf_counter() - start,
+                }
+                self._write_state(sub_id, state)
+        return state
+
+    def run(self, subject_ids: List[str], force: bool = False) -> Dict[str, Dict]:
+        states = Parallel(n_jobs=self.n_jobs)(
+            delayed(self.run_subject)(sub_id, force) for sub_id in subject_ids
+        )
+        report = dict(zip(subject_ids, states))
+        failed = [
+            sub_id
+            for sub_id, state in report.items()
+            if any(stage.get("status") != "done" for stage in state.values())
+        ]
+        logger.info("Finished %d/%d subjects", len(subject_ids) - len(failed), len(subject_ids))
+        if failed:
+            logger.warning("Incomplete: %s", failed)
+        return report
+
+
+def default_stages(
+    data_dir: str,
+    times_tup: tuple,
+    roi_names: List[str],
+    include_noise: bool = False,
+    method: str = "MNE",
+    time_win_path: str = "",
+) -> List[Stage]:
+    """raw -> cropped resting EEG -> epochs -> source localization, as in the notebooks
+
+    The stage functions come from eeg_toolkit, which must be importable.
+    """
+    data_path = os.path.join(data_dir, "EEG DATA")
+    processed_data_path = os.path.join(data_dir, "Processed Data")
+    csv_path = os.path.join(data_dir, "Eyes Timestamps")
+    resting_path = processed_data_path if include_noise else os.path.join(processed_data_path, "5min")
+    stc_path = os.path.join(data_dir, f"Source Time Courses ({method})")
+    zscored_epochs_path = os.path.join(stc_path, "zscored_Epochs", time_win_path)
+    EO_resting_path = os.path.join(stc_path, "Eyes Open")
+    EC_resting_path = os.path.join(stc_path, "Eyes Closed")
+
+    def to_raw(sub_id, **params):
+        from eeg_toolkit import preprocess
+
+        preprocess.to_raw(data_path, sub_id, save_path=processed_data_path, csv_path=csv_path, **params)
+
+    def to_resting(sub_id, **params):
+        import mne
+        from eeg_toolkit import preprocess
+
+        os.makedirs(resting_path, exist_ok=True)
+        raw = mne.io.read_raw_fif(
+            os.path.join(processed_data_path, f"{sub_id}_preprocessed-raw.fif"), preload=True
+        )
+        preprocess.get_cropped_resting_EEGs(sub_id, raw, csv_path, resting_path, **params)
+
+    def to_epo(sub_id, **params):
+        import mne
+        from eeg_toolkit import preprocess
+
+        raw = mne.io.read_raw_fif(
+            os.path.join(processed_data_path, f"{sub_id}_preprocessed-raw.fif"), preload=True
+        )
+        preprocess.to_epo(raw, sub_id, data_path, save_path=processed_data_path, **params)
+
+    def to_source(sub_id, roi_names, times_tup, **params):
+        from eeg_toolkit import source_localization
+
+        for path in [zscored_epochs_path, EO_resting_path, EC_resting_path]:
+            os.makedirs(path, exist_ok=True)
+        source_localization.to_source(
+            sub_id,
+            processed_data_path,
+            zscored_epochs_path,
+            EC_resting_path,
+            EO_resting_path,
+            roi_names,
+            tuple(times_tup),
+            **params,
+        )
+
+    return [
+        Stage(
+            "raw",
+            to_raw,
+            inputs=[os.path.join(data_path, "{sub_id}*")],
+            outputs=[os.path.join(processed_data_path, "{sub_id}_preprocessed-raw.fif")],
+            params={"include_noise": include_noise},
+        ),
+        Stage(
+            "resting",
+            to_resting,
+            inputs=[os.path.join(processed_data_path, "{sub_id}_preprocessed-raw.fif")],
+            outputs=[os.path.join(resting_path, "{sub_id}_eyes_open-raw.fif")],
+            params={"include_noise": include_noise},
+        ),
+        Stage(
+            "epochs",
+            to_epo,
+            inputs=[os.path.join(processed_data_path, "{sub_id}_preprocessed-raw.fif")],
+            outputs=[os.path.join(processed_data_path, "{sub_id}_preprocessed-epo.fif")],
+        ),
+        Stage(
+            "source",
+            to_source,
+            inputs=[os.path.join(processed_data_path, "{sub_id}_preprocessed-epo.fif")],
+            outputs=[os.path.join(zscored_epochs_path, "{sub_id}_epochs.pkl")],
+            params={
+                "roi_names": roi_names,
+                "times_tup": list(times_tup),
+                "method": method,
+                "return_zepochs": True,
+                "return_EC_resting": False,
+                "return_EO_resting": True,
+                "average_dipoles": True,
+                "save_stc_mat": False,
+                "save_inv": True,
+            },
+        ),
+    ]
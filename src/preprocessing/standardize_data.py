@@ -0,0 +1,192 @@
+import logging
+import os
+import numpy as np
+from typing import Dict, Iterator, Optional, Tuple
+
+from src.utils.accumulators import RunningMoments
+from src.utils.file_handling import ArrayStore
+
+logger = logging.getLogger(__name__)
+
+
+def _trial_chunks(n_trials: int, chunk_size: int) -> Iterator[slice]:
+    for start in range(0, n_trials, chunk_size):
+        yield slice(start, min(start + chunk_size, n_trials))
+
+
+def baseline_mask(times: np.ndarray, baseline: Optional[Tuple[float, float]]) -> np.ndarray:
+    """Boolean time mask for a (tmin, tmax) window; None bounds are open, as in MNE"""
+    times = np.asarray(times)
+    if baseline is None:
+        return np.ones(len(times), dtype=bool)
+    tmin, tmax = baseline
+    tmin = times[0] if tmin is None else tmin
+    tmax = times[-1] if tmax is None else tmax
+    mask = (times >= tmin) & (times <= tmax)
+    assert mask.any(), f"Baseline {baseline} lies outside [{times[0]}, {times[-1]}]"
+    return mask
+
+
+def compute_roi_moments(
+    data: np.ndarray,
+    time_mask: Optional[np.ndarray] = None,
+    chunk_size: int = 32,
+) -> RunningMoments:
+    """Per-ROI mean/variance over trials and time of a (n_trials, n_rois, n_times) array
+
+    Trials are read chunk_size at a time, so data can be memory-mapped.
+    """
+    n_trials, n_rois, _ = data.shape
+    moments = RunningMoments()
+    for rows in _trial_chunks(n_trials, chunk_size):
+        chunk = data[rows] if time_mask is None else data[rows][..., time_mask]
+        # (trials, roi, time) -> (trials * time, roi): every sample of a ROI on axis 0
+        moments.update(chunk.transpose(0, 2, 1).reshape(-1, n_rois))
+    return moments
+
+
+def iter_zscored_chunks(
+    data: np.ndarray,
+    mean: np.ndarray,
+    std: np.ndarray,
+    chunk_size: int = 32,
+    dtype=np.float32,
+) -> Iterator[Tuple[slice, np.ndarray]]:
+    """(trial slice, z-scored block) pairs, one chunk of trials in memory at a time"""
+    mean = np.asarray(mean, dtype=np.float64)[:, None]
+    scale = 1.0 / np.asarray(std, dtype=np.float64)[:, None]
+    for rows in _trial_chunks(len(data), chunk_size):
+        block = data[rows] - mean  # float64 copy, so the input is never written to
+        block *= scale
+        yield rows, block.astype(dtype, copy=False)
+
+
+def standardize_array(
+    data: np.ndarray,
+    store: ArrayStore,
+    key: str,
+    name: str = "zscored",
+    times: Optional[np.ndarray] = None,
+    baseline: Optional[Tuple[float, float]] = None,
+    chunk_size: int = 32,
+    sources=(),
+    dtype=np.float32,
+    **meta,
+) -> Dict:
+    """Two-pass per-ROI z-scoring of (n_trials, n_rois, n_times) data into store
+
+    Pass one accumulates each ROI's mean/std (over the baseline window only if
+    baseline is given, which needs times); pass two writes the z-scored trials
+    (float32 by default) to a memory-mapped file. Peak memory is one chunk of
+    trials when data is memory-mapped.
+    """
+    assert data.ndim == 3, "Expected data of shape (n_trials, n_rois, n_times)"
+    time_mask = None
+    if baseline is not None:
+        assert times is not None, "times are needed to select a baseline window"
+        time_mask = baseline_mask(times, baseline)
+
+    moments = compute_roi_moments(data, time_mask, chunk_size)
+    mean, std = moments.mean, moments.std()
+    std = np.where(std > 0, std, 1.0)  # leave flat ROIs centred rather than NaN
+
+    return store.write_chunks(
+        key,
+        name,
+        data.shape,
+        dtype,
+        iter_zscored_chunks(data, mean, std, chunk_size, dtype),
+        sources,
+        roi_mean=mean.tolist(),
+        roi_std=std.tolist(),
+        baseline=None if baseline is None else list(baseline),
+        **meta,
+    )
+
+
+def _open_input(input_path: str) -> np.ndarray:
+    # only .npy can be memory-mapped; a pickle would be unpickled whole
+    if not input_path.endswith(".npy"):
+        raise ValueError(
+            f"Cannot stream {input_path}; pass a .npy file, or use standardize_subject "
+            "for the pickled STC epochs, which reads the processor's memory-mapped cache"
+        )
+    return np.load(input_path, mmap_mode="r")
+
+
+def standardize_data(
+    input_path: str,
+    output_path: str,
+    times: Optional[np.ndarray] = None,
+    baseline: Optional[Tuple[float, float]] = None,
+    chunk_size: int = 32,
+) -> Tuple[np.ndarray, Dict]:
+    """Z-score one subject's STC epochs (.npy) into an ArrayStore at output_path
+
+    The result is stored under the input file's base name and returned
+    memory-mapped with its manifest; it is rebuilt only if the input or the
+    baseline changed.
+    """
+    store = ArrayStore(output_path)
+    key = os.path.splitext(os.path.basename(input_path))[0]
+    baseline_list = None if baseline is None else list(baseline)
+    if not (
+        store.is_fresh(key, "zscored", [input_path])
+        and store.read_manifest(key, "zscored").get("baseline") == baseline_list
+    ):
+        logger.info("Standardizing %s", input_path)
+        standardize_array(
+            _open_input(input_path),
+            store,
+            key,
+            times=times,
+            baseline=baseline,
+            chunk_size=chunk_size,
+            sources=[input_path],
+        )
+    return store.read(key, "zscored")
+
+
+def standardize_subject(
+    processor,
+    subject_id: str,
+    baseline: Optional[Tuple[float, float]] = None,
+    chunk_size: int = 32,
+) -> Tuple[np.ndarray, Dict]:
+    """Z-score a subject's STC epochs from the processor's memory-mapped cache
+
+    Streams the stc_epochs ArrayStore entry into a stc_epochs_zscored entry
+    beside it, in the processor's dtype and with its label index, so only one
+    chunk of trials is ever in memory. Rebuilt when the STC sources or the
+    baseline change; a baseline takes its times from the subject's epochs.
+    SubjectProcessor._read_stc_epochs returns this entry when zscore_stc is set.
+    """
+    store = processor.store
+    name = processor._cache_name("stc_epochs_zscored")
+    sources = processor._stc_sources(subject_id)
+    baseline_list = None if baseline is None else list(baseline)
+    if (
+        store.is_fresh(subject_id, name, sources)
+        and store.read_manifest(subject_id, name).get("baseline") == baseline_list
+    ):
+        return store.read(subject_id, name)
+
+    stc_epo, manifest = processor._read_stc_epochs(subject_id, zscore=False)
+    times = None
+    if baseline is not None:
+        times = np.asarray(processor._read_epochs_data(subject_id)[1]["times"])
+        assert len(times) == stc_epo.shape[-1], "STC epochs and epochs differ in length"
+    logger.info("Standardizing STC epochs of %s", subject_id)
+    standardize_array(
+        stc_epo,
+        store,
+        subject_id,
+        name,
+        times=times,
+        baseline=baseline,
+        chunk_size=chunk_size,
+        sources=sources,
+        dtype=processor.dtype,
+        label_index=manifest["label_index"],
+    )
+    return store.read(subject_id, name)
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class RunningMoments:
+    """NaN-aware running count/mean/M2 per element (Welford, with Chan et al. merging)
+
+    Samples are folded in along axis 0; NaNs are skipped element-wise, so the
+    result matches np.nanmean/np.nanstd over all samples seen so far.
+    """
+
+    def __init__(self):
+        self.count = None
+        self._mean = None
+        self._m2 = None
+
+    @classmethod
+    def empty(cls, shape) -> "RunningMoments":
+        """Accumulator of known element shape with no samples; its mean and var are NaN"""
+        moments = cls()
+        moments._combine(np.zeros(shape, dtype=np.int64), np.zeros(shape), np.zeros(shape))
+        return moments
+
+    def _check(self):
+        if self.count is None:
+            raise ValueError(
+                "RunningMoments has no samples; call update() or use RunningMoments.empty(shape)"
+            )
+
+    def update(self, batch: np.ndarray) -> "RunningMoments":
+        """Fold in a block of samples stacked along axis 0"""
+        batch = np.asarray(batch, dtype=np.float64)
+        valid = ~np.isnan(batch)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, np.where(valid, batch, 0.0).sum(axis=0) / count, 0.0)
+        m2 = np.where(valid, (batch - mean) ** 2, 0.0).sum(axis=0)
+        self._combine(count, mean, m2)
+        return self
+
+    def merge(self, other: "RunningMoments") -> "RunningMoments":
+        """Fold in a partial accumulator, e.g. one returned by a pool worker"""
+        if other.count is not None:
+            self._combine(other.count, other._mean, other._m2)
+        return self
+
+    def _combine(self, count, mean, m2):
+        if self.count is None:
+            self.count, self._mean, self._m2 = count, mean, m2
+            return
+        total = self.count + count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = np.where(total > 0, count / total, 0.0)
+        delta = mean - self._mean
+        self._mean = self._mean + delta * frac
+        self._m2 = self._m2 + m2 + delta**2 * self.count * frac
+        self.count = total
+
+    @property
+    def mean(self) -> np.ndarray:
+        self._check()
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    def var(self, ddof: int = 0) -> np.ndarray:
+        self._check()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > ddof, self._m2 / (self.count - ddof), np.nan)
+
+    def std(self, ddof: int = 0) -> np.ndarray:
+        return np.sqrt(self.var(ddof))
@@ -0,0 +1,256 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.configs.config import CFGLog
+from src.utils.synthetic_data import make_cohort
+
+# name -> (n_subjects, n_trials per subject)
+SCALES = {
+    "small": (2, 30),
+    "medium": (8, 60),
+    "large": (16, 120),
+}
+
+
+def measure(fn: Callable, setup: Optional[Callable] = None, repeats: int = 3) -> Dict[str, float]:
+    """Best-of-repeats wall time and peak traced allocation of fn()
+
+    setup runs before every repeat, outside the measurement (e.g. to clear a cache).
+    """
+    seconds, peaks = [], []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_mb": max(peaks) / 1024**2}
+
+
+def _make_bench_processor(paths_dict: Dict[str, str], precision: str = "float64"):
+    import matplotlib
+
+    matplotlib.use("Agg")  # plt.show() in _plot_tfr must not block
+    from src.preprocessing.processor import SubjectProcessor
+    from src.visualization.plot_results import Visualizer
+
+    data_info = CFGLog["data_info"]
+
+    class BenchProcessor(SubjectProcessor, Visualizer):
+        def __init__(self):
+            SubjectProcessor.__init__(self, paths_dict, data_info["roi_acronyms"], precision)
+            Visualizer.__init__(
+                self,
+                self.sfreq,
+                data_info["roi_names"],
+                data_info["roi_acronyms"],
+                data_info["freq_bands"],
+                paths_dict["stc_path"],
+                "bench_model.pkl",
+                precision=precision,
+            )
+
+    return BenchProcessor()
+
+
+def bench_scale(
+    root: str,
+    n_subjects: int,
+    n_trials: int,
+    repeats: int = 3,
+    n_jobs: int = 1,
+    precision: str = "float64",
+) -> Dict[str, Dict[str, float]]:
+    """Time the loaders, TFR and TFR plot on a fresh synthetic cohort"""
+    import matplotlib.pyplot as plt
+    from src.preprocessing.processor import Subject, SubjectGroup
+    from src.utils.tfr_cache import TFRCache
+
+    paths_dict, subject_ids = make_cohort(
+        root, n_subjects=n_subjects, n_trials=n_trials, missing_channels_every=4
+    )
+    processor = _make_bench_processor(paths_dict, precision)
+    group = SubjectGroup([Subject(sub_id) for sub_id in subject_ids])
+    sub_id = subject_ids[0]
+
+    def clear_arrays():
+        shutil.rmtree(processor.cache_path, ignore_errors=True)
+
+    def clear_tfr():
+        processor.tfr_cache = TFRCache()
+
+    results = {}
+    # cold reads convert the source files into the array cache; warm reads map it
+    results["_load_epochs (cold)"] = measure(lambda: processor._load_epochs(sub_id), clear_arrays, repeats)
+    results["_load_epochs"] = measure(lambda: processor._load_epochs(sub_id), None, repeats)
+    results["_load_stc_epochs (cold)"] = measure(
+        lambda: processor._load_stc_epochs(sub_id), clear_arrays, repeats
+    )
+    results["_load_stc_epochs"] = measure(lambda: processor._load_stc_epochs(sub_id), None, repeats)
+    # the plot and report paths skip the resting spectrum; it is timed on its own
+    results["_load_complete_data (cold)"] = measure(
+        lambda: processor._load_complete_data(group, n_jobs=n_jobs, resting=False),
+        clear_arrays,
+        repeats,
+    )
+    results["_load_complete_data"] = measure(
+        lambda: processor._load_complete_data(group, n_jobs=n_jobs, resting=False), None, repeats
+    )
+    results["_load_complete_data (resting, cold)"] = measure(
+        lambda: processor._load_complete_data(group, n_jobs=n_jobs), clear_arrays, repeats
+    )
+    results["_load_complete_data (resting)"] = measure(
+        lambda: processor._load_complete_data(group, n_jobs=n_jobs), None, repeats
+    )
+
+    complete_data = processor._load_complete_data(group, n_jobs=n_jobs, resting=False)
+    results["_compute_tfr"] = measure(
+        lambda: processor._compute_tfr(group, complete_data=complete_data), clear_tfr, repeats
+    )
+
+    tfr = processor._compute_tfr(group, complete_data=complete_data)
+    results["_plot_tfr"] = measure(
+        lambda: plt.close(processor._plot_tfr(tfr, (-2.5, 0.0), "benchmark")), None, repeats
+    )
+
+    # one subject's hand trials, (n_trials, n_rois, n_times)
+    stc_trials = np.asarray(processor._load_stc_trials(sub_id))
+    results.update(bench_morlet(stc_trials, processor.sfreq, repeats, precision))
+    return results
+
+
+def bench_morlet(
+    data: np.ndarray, sfreq: float, repeats: int = 3, precision: str = "float64"
+) -> Dict[str, Dict[str, float]]:
+    """MorletTFR against mne.time_frequency.tfr_array_morlet on (n_epochs, n_chans, n_times) data
+
+    Uses the frequencies of Visualizer._compute_tfr and MNE's wavelets
+    (zero_mean=False), at full resolution, decimated and collapsed to bands.
+    """
+    from mne.time_frequency import tfr_array_morlet
+    from src.analysis.tfr import MorletTFR
+    from src.utils.config import get_dtype
+
+    freqs = np.logspace(*np.log10([1, 100]), num=50)
+    n_cycles = freqs / 2.0
+    dtype = get_dtype(precision)
+    freq_bands = CFGLog["data_info"]["freq_bands"]
+
+    def mne_tfr(decim=1):
+        return tfr_array_morlet(
+            data,
+            sfreq,
+            freqs,
+            n_cycles,
+            zero_mean=False,
+            decim=decim,
+            output="avg_power",
+            verbose=False,
+        )
+
+    def fft_tfr(decim=1, bands=None):
+        engine = MorletTFR(sfreq, freqs, n_cycles, decim=decim, dtype=dtype)
+        return engine.transform(data, output="avg_power", freq_bands=bands)
+
+    return {
+        "tfr_array_morlet (mne)": measure(mne_tfr, None, repeats),
+        "MorletTFR": measure(fft_tfr, None, repeats),
+        "tfr_array_morlet (mne, decim=4)": measure(lambda: mne_tfr(4), None, repeats),
+        "MorletTFR (decim=4)": measure(lambda: fft_tfr(4), None, repeats),
+        "MorletTFR (decim=4, bands)": measure(lambda: fft_tfr(4, freq_bands), None, repeats),
+    }
+
+
+def run_benchmarks(
+    scales: List[str] = ("small", "medium"),
+    output_json: Optional[str] = None,
+    repeats: int = 3,
+    n_jobs: int = 1,
+    work_dir: Optional[str] = None,
+    precision: str = "float64",
+) -> Dict:
+    """Benchmark every scale on synthetic cohorts written to a temporary directory"""
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "n_cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "repeats": repeats,
+            "n_jobs": n_jobs,
+            "precision": precision,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "scales": {},
+    }
+    for scale in scales:
+        n_subjects, n_trials = SCALES[scale]
+        root = tempfile.mkdtemp(prefix=f"bench_{scale}_", dir=work_dir)
+        try:
+            print(f"\nBenchmarking {scale}: {n_subjects} subjects x {n_trials} trials")
+            results["scales"][scale] = bench_scale(
+                root, n_subjects, n_trials, repeats, n_jobs, precision
+            )
+            timings = results["scales"][scale]
+            for fft_name, mne_name in [
+                ("MorletTFR", "tfr_array_morlet (mne)"),
+                ("MorletTFR (decim=4)", "tfr_array_morlet (mne, decim=4)"),
+            ]:
+                speedup = timings[mne_name]["seconds"] / timings[fft_name]["seconds"]
+                print(f"{fft_name} is x{speedup:.2f} faster than {mne_name}")
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if output_json is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(output_json)), exist_ok=True)
+        with open(output_json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved benchmark results to {output_json}")
+    return results
+
+
+def compare(
+    results: Dict,
+    baseline: Dict,
+    time_tolerance: float = 1.25,
+    memory_tolerance: float = 1.25,
+    min_seconds: float = 0.01,
+) -> List[Tuple[str, str, str, float, float]]:
+    """Regressions of results against a stored baseline run
+
+    A benchmark regresses if it is more than time_tolerance times slower (and
+    slower than min_seconds, to ignore timer noise) or its peak allocation
+    grew by more than memory_tolerance. Returns (scale, benchmark, metric,
+    baseline, current) tuples, and prints a table of every ratio.
+    """
+    regressions = []
+    for scale, benchmarks in results["scales"].items():
+        for name, current in benchmarks.items():
+            previous = baseline.get("scales", {}).get(scale, {}).get(name)
+            if previous is None:
+                print(f"{scale:>8} {name:<36} (new)")
+                continue
+            time_ratio = current["seconds"] / max(previous["seconds"], 1e-9)
+            memory_ratio = current["peak_mb"] / max(previous["peak_mb"], 1e-9)
+            flags = []
+            if time_ratio > time_tolerance and current["seconds"] > min_seconds:
+                regressions.append((scale, name, "seconds", previous["seconds"], current["seconds"]))
+                flags.append("SLOWER")
+            if memory_ratio > memory_tolerance:
+                regressions.append((scale, name, "peak_mb", previous["peak_mb"], current["peak_mb"]))
+                flags.append("MORE MEMORY")
+            print(
+                f"{scale:>8} {name:<36} {current['seconds']:8.3f} s (x{time_ratio:.2f}) "
+                f"{current['peak_mb']:8.1f} MB (x{memory_ratio:.2f}) {' '.join(flags)}"
+            )
+    return regressions
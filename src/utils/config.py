@@ -1,4 +1,7 @@
 import json
+import numpy as np
+
+PRECISIONS = {"float64": np.float64, "float32": np.float32}
 
 
 class Config:
@@ -13,8 +16,20 @@ class Config:
     def from_json(cls, cfg):
         """Creates config from json"""
         params = json.loads(json.dumps(cfg), object_hook=HelperDict)
+        # CFGLog keeps its data settings under "data_info"
+        data = params.data if hasattr(params, "data") else params.data_info
         # init all class instance with data and train attributes
-        return cls(params.data, params.train, params.output)
+        return cls(data, params.train, params.output)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Array dtype for the configured data precision (float64 if unset)"""
+        return get_dtype(getattr(self.data, "precision", "float64"))
+
+
+def get_dtype(precision: str) -> np.dtype:
+    assert precision in PRECISIONS, f"precision must be one of {list(PRECISIONS)}"
+    return np.dtype(PRECISIONS[precision])
 
 
 class HelperDict(object):
@@ -0,0 +1,197 @@
+import logging
+import numpy as np
+from joblib import Parallel, delayed
+from typing import TYPE_CHECKING, Dict, List
+
+from src.utils.accumulators import RunningMoments
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def channel_stats(data: np.ndarray, chunk_size: int = 32) -> Dict[str, np.ndarray]:
+    """Per-channel and per-trial statistics of a (n_trials, n_channels, n_times) array
+
+    Everything is gathered in one pass over chunks of trials, so data can be
+    memory-mapped: NaN counts, running mean/std, min/max, the number of
+    repeated consecutive samples (clipping) and each trial's peak amplitude.
+    """
+    n_trials, n_channels, n_times = data.shape
+    nan_count = np.zeros(n_channels, dtype=np.int64)
+    repeat_count = np.zeros(n_channels, dtype=np.int64)
+    ch_min = np.full(n_channels, np.inf)
+    ch_max = np.full(n_channels, -np.inf)
+    trial_peak = np.zeros(n_trials)
+    moments = RunningMoments()
+
+    for start in range(0, n_trials, chunk_size):
+        chunk = np.asarray(data[start : start + chunk_size], dtype=np.float64)
+        is_nan = np.isnan(chunk)
+        nan_count += is_nan.sum(axis=(0, 2))
+        repeat_count += (np.diff(chunk, axis=-1) == 0).sum(axis=(0, 2))
+        ch_min = np.fmin(ch_min, np.fmin.reduce(chunk, axis=(0, 2)))
+        ch_max = np.fmax(ch_max, np.fmax.reduce(chunk, axis=(0, 2)))
+        trial_peak[start : start + len(chunk)] = np.where(is_nan, 0.0, np.abs(chunk)).max(axis=(1, 2))
+        moments.update(chunk.transpose(0, 2, 1).reshape(-1, n_channels))
+
+    return {
+        "nan_fraction": nan_count / max(n_trials * n_times, 1),
+        "repeat_fraction": repeat_count / max(n_trials * (n_times - 1), 1),
+        "mean": moments.mean,
+        "std": moments.std(),
+        "min": ch_min,
+        "max": ch_max,
+        "trial_peak": trial_peak,
+    }
+
+
+class DataValidator:
+    """Checks each subject's cached epochs and STC epochs before a group load
+
+    Per subject, in one pass over each memory-mapped array: all-NaN or partly
+    NaN channels, flat channels, saturated (clipped) channels, amplitude
+    outlier trials and per-label trial counts. Across the group: trial length,
+    ROI count, sfreq and time axis consistency. Subjects are checked in a process pool.
+    """
+
+    def __init__(
+        self,
+        processor,
+        labels=(3,),
+        chunk_size: int = 32,
+        max_nan_fraction: float = 0.0,
+        flat_std: float = 1e-15,
+        max_repeat_fraction: float = 0.2,
+        outlier_mads: float = 10.0,
+    ):
+        self.processor = processor
+        self.labels = labels
+        self.chunk_size = chunk_size
+        self.max_nan_fraction = max_nan_fraction
+        self.flat_std = flat_std
+        self.max_repeat_fraction = max_repeat_fraction
+        self.outlier_mads = outlier_mads
+
+    def _channel_issues(self, data: np.ndarray, names: List[str], kind: str) -> Dict[str, List]:
+        stats = channel_stats(data, self.chunk_size)
+        nan_fraction = stats["nan_fraction"]
+        finite = nan_fraction < 1
+        varying = finite & (stats["std"] > self.flat_std)
+        peak = stats["trial_peak"]
+        median = np.median(peak)
+        mad = np.median(np.abs(peak - median))
+        outliers = peak > median + self.outlier_mads * max(mad, np.finfo(float).tiny)
+
+        def named(mask):
+            return [names[i] for i in np.flatnonzero(mask)]
+
+        return {
+            f"all_nan_{kind}": named(~finite),
+            f"nan_{kind}": named(finite & (nan_fraction > self.max_nan_fraction)),
+            f"flat_{kind}": named(finite & ~varying),
+            f"saturated_{kind}": named(varying & (stats["repeat_fraction"] > self.max_repeat_fraction)),
+            f"outlier_trials_{kind}": np.flatnonzero(outliers).tolist(),
+        }
+
+    def check_subject(self, subject_id: str) -> Dict:
+        processor = self.processor
+        report = {"subject_id": subject_id, "errors": []}
+        try:
+            epo, epo_meta = processor._read_epochs_data(subject_id)
+            stc, stc_meta = processor._read_stc_epochs(subject_id)
+        except (FileNotFoundError, AssertionError) as e:
+            report["errors"].append(str(e))
+            return report
+
+        ch_names = epo_meta["ch_names"]
+        times = np.asarray(epo_meta["times"])
+        roi_names = list(processor.roi_acronyms)
+        if len(roi_names) != stc.shape[1]:
+            report["errors"].append(f"{stc.shape[1]} STC ROIs but {len(roi_names)} ROI names")
+            roi_names = [str(i) for i in range(stc.shape[1])]
+        report.update(
+            n_trials=epo.shape[0],
+            n_channels=epo.shape[1],
+            n_times=epo.shape[2],
+            n_stc_trials=stc.shape[0],
+            n_rois=stc.shape[1],
+            n_stc_times=stc.shape[2],
+            sfreq=epo_meta["sfreq"],
+            tmin=float(times[0]),
+            tmax=float(times[-1]),
+            # these become all-NaN channels once aligned to the montage
+            missing_channels=processor.montage.missing(ch_names),
+            **self._channel_issues(epo, ch_names, "channels"),
+            **self._channel_issues(stc, roi_names, "rois"),
+        )
+
+        label_index = stc_meta.get("label_index", {})
+        for label in self.labels:
+            n_label = len(label_index.get(str(int(label)), []))
+            report[f"n_label_{label}"] = n_label
+            if n_label == 0:
+                report["errors"].append(f"no trials with label {label}")
+        for column in ["all_nan_channels", "all_nan_rois", "nan_rois"]:
+            if report[column]:
+                report["errors"].append(f"{column} {report[column]}")
+        return report
+
+    def validate(
+        self, subject_ids: List[str], n_jobs: int = 1, verbose: bool = True
+    ) -> "pd.DataFrame":
+        """One row per subject; the 'errors' column lists what would break a group load"""
+        import pandas as pd
+
+        reports = Parallel(n_jobs=n_jobs)(
+            delayed(self.check_subject)(sub_id) for sub_id in subject_ids
+        )
+        report = pd.DataFrame(reports).set_index("subject_id")
+
+        # group consistency against the most common value of each property; the
+        # channel count may differ, since epochs are aligned to the montage
+        for column in ["n_times", "n_rois", "n_stc_times", "sfreq", "tmin", "tmax"]:
+            if column not in report:
+                continue
+            values = report[column].dropna()
+            if values.empty:
+                continue
+            expected = values.mode().iloc[0]
+            for sub_id in values.index[values != expected]:
+                report.at[sub_id, "errors"].append(
+                    f"{column}={values[sub_id]} (group: {expected})"
+                )
+
+        report["ok"] = report["errors"].map(len) == 0
+        if verbose:
+            self.summarize(report)
+        return report
+
+    def summarize(self, report: "pd.DataFrame"):
+        logger.info("Validated %d subjects: %d ok", len(report), int(report["ok"].sum()))
+        for sub_id, row in report.iterrows():
+            warnings = [
+                f"{column}={row[column]}"
+                for column in [
+                    "nan_channels",
+                    "flat_channels",
+                    "saturated_channels",
+                    "flat_rois",
+                    "saturated_rois",
+                    "outlier_trials_channels",
+                    "outlier_trials_rois",
+                ]
+                if column in row and isinstance(row[column], list) and row[column]
+            ]
+            # errors fail the group load; the rest are data-quality notes
+            if row["errors"]:
+                logger.warning("%s: %s", sub_id, "; ".join(row["errors"] + warnings))
+            elif warnings:
+                logger.info("%s: %s", sub_id, "; ".join(warnings))
+
+
+def validate_subjects(
+    processor, subject_ids: List[str], n_jobs: int = 1, labels=(3,), **kwargs
+) -> "pd.DataFrame":
+    return DataValidator(processor, labels, **kwargs).validate(subject_ids, n_jobs)
@@ -0,0 +1,117 @@
+import json
+import os
+import numpy as np
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+class ArrayStore:
+    """Per-subject cache of flat binary arrays, each with a small JSON manifest"""
+
+    def __init__(self, root: str):
+        self.root = str(root)
+
+    def _paths(self, key: str, name: str) -> Tuple[str, str]:
+        key_dir = os.path.join(self.root, key)
+        return (
+            os.path.join(key_dir, f"{name}.dat"),
+            os.path.join(key_dir, f"{name}.json"),
+        )
+
+    def read_manifest(self, key: str, name: str) -> Dict:
+        _, manifest_fname = self._paths(key, name)
+        with open(manifest_fname, "r") as f:
+            return json.load(f)
+
+    def is_fresh(self, key: str, name: str, sources: List[str]) -> bool:
+        """True if the cached array exists and no source file is newer than it"""
+        data_fname, manifest_fname = self._paths(key, name)
+        if not (os.path.isfile(data_fname) and os.path.isfile(manifest_fname)):
+            return False
+        try:
+            cached_sources = self.read_manifest(key, name)["sources"]
+        except (ValueError, KeyError):
+            return False
+        for source in sources:
+            source = str(source)
+            if source not in cached_sources or not os.path.isfile(source):
+                return False
+            if os.path.getmtime(source) > cached_sources[source]:
+                return False
+        return True
+
+    def write(
+        self, key: str, name: str, array: np.ndarray, sources: List[str] = (), **meta
+    ) -> Dict:
+        data_fname, manifest_fname = self._paths(key, name)
+        os.makedirs(os.path.dirname(data_fname), exist_ok=True)
+        array = np.ascontiguousarray(array)
+
+        # write data first and the manifest last, so an interrupted write is stale
+        tmp_fname = f"{data_fname}.tmp"
+        array.tofile(tmp_fname)
+        os.replace(tmp_fname, data_fname)
+        return self._write_manifest(manifest_fname, array.shape, array.dtype, sources, meta)
+
+    def write_chunks(
+        self,
+        key: str,
+        name: str,
+        shape: Tuple[int, ...],
+        dtype,
+        chunks: Iterable[Tuple[slice, np.ndarray]],
+        sources: List[str] = (),
+        **meta,
+    ) -> Dict:
+        """Write an array too large for memory from (axis-0 slice, block) pairs"""
+        data_fname, manifest_fname = self._paths(key, name)
+        os.makedirs(os.path.dirname(data_fname), exist_ok=True)
+        dtype = np.dtype(dtype)
+
+        tmp_fname = f"{data_fname}.tmp"
+        if int(np.prod(shape)) == 0:
+            open(tmp_fname, "wb").close()
+        else:
+            out = np.memmap(tmp_fname, dtype=dtype, mode="w+", shape=tuple(shape))
+            for rows, block in chunks:
+                out[rows] = block
+            out.flush()
+            del out
+        os.replace(tmp_fname, data_fname)
+        return self._write_manifest(manifest_fname, shape, dtype, sources, meta)
+
+    def _write_manifest(self, manifest_fname, shape, dtype, sources, meta) -> Dict:
+        manifest = {
+            "shape": list(shape),
+            "dtype": np.dtype(dtype).str,
+            "sources": {str(s): os.path.getmtime(s) for s in sources},
+            **meta,
+        }
+        tmp_fname = f"{manifest_fname}.tmp"
+        with open(tmp_fname, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_fname, manifest_fname)
+        return manifest
+
+    def read(self, key: str, name: str, mmap_mode: str = "r") -> Tuple[np.ndarray, Dict]:
+        """Open a cached array memory-mapped, along with its manifest"""
+        data_fname, _ = self._paths(key, name)
+        manifest = self.read_manifest(key, name)
+        shape = tuple(manifest["shape"])
+        dtype = np.dtype(manifest["dtype"])
+        if int(np.prod(shape)) == 0:  # np.memmap cannot map an empty file
+            return np.empty(shape, dtype=dtype), manifest
+        data = np.memmap(data_fname, dtype=dtype, mode=mmap_mode, shape=shape)
+        return data, manifest
+
+    def load_or_build(
+        self,
+        key: str,
+        name: str,
+        sources: List[str],
+        build_fn: Callable[[], Tuple[np.ndarray, Dict]],
+    ) -> Tuple[np.ndarray, Dict]:
+        """Read a cached array, (re)building it with build_fn if missing or stale"""
+        if not self.is_fresh(key, name, sources):
+            array, meta = build_fn()
+            self.write(key, name, array, sources, **meta)
+        return self.read(key, name)
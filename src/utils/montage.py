@@ -0,0 +1,67 @@
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+CH_NAMES_64 = [
+    "Fp1", "Fpz", "Fp2", "AF3", "AF4", "F11", "F7", "F5", "F3", "F1", "Fz", "F2",
+    "F4", "F6", "F8", "F12", "FT11", "FC5", "FC3", "FC1", "FCz", "FC2", "FC4", "FC6",
+    "FT12", "T7", "C5", "C3", "C1", "Cz", "C2", "C4", "C6", "T8", "TP7", "CP5",
+    "CP3", "CP1", "CPz", "CP2", "CP4", "CP6", "TP8", "M1", "M2", "P7", "P5", "P3",
+    "P1", "Pz", "P2", "P4", "P6", "P8", "PO7", "PO3", "POz", "PO4", "PO8", "O1",
+    "Oz", "O2", "Cb1", "Cb2",
+]
+
+
+class Montage:
+    """Target channel layout with cached source -> target index maps"""
+
+    def __init__(self, ch_names: List[str] = CH_NAMES_64):
+        self.ch_names = [ch_name.upper() for ch_name in ch_names]
+        self._positions = {ch_name: i for i, ch_name in enumerate(self.ch_names)}
+        self._index_maps: Dict[Tuple[str, ...], Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self):
+        return len(self.ch_names)
+
+    def index_map(self, ch_names: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(source, target) channel indices, computed once per channel layout"""
+        layout = tuple(ch_names)
+        if layout not in self._index_maps:
+            pairs = [
+                (src, self._positions[ch_name.upper()])
+                for src, ch_name in enumerate(layout)
+                if ch_name.upper() in self._positions
+            ]
+            src_ids, dst_ids = zip(*pairs) if pairs else ((), ())
+            self._index_maps[layout] = (
+                np.array(src_ids, dtype=int),
+                np.array(dst_ids, dtype=int),
+            )
+        return self._index_maps[layout]
+
+    def missing(self, ch_names: List[str]) -> List[str]:
+        _, dst_ids = self.index_map(ch_names)
+        present = set(dst_ids.tolist())
+        return [ch for i, ch in enumerate(self.ch_names) if i not in present]
+
+    def align(
+        self, data: np.ndarray, ch_names: List[str], out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Scatter (..., n_chans, n_times) data into a NaN-filled montage buffer
+
+        Channels missing from ch_names stay NaN and channels outside the montage
+        are dropped; data is copied once, straight into its target rows.
+        """
+        src_ids, dst_ids = self.index_map(ch_names)
+        shape = data.shape[:-2] + (len(self), data.shape[-1])
+        if out is None:
+            out = np.empty(shape, dtype=np.result_type(data.dtype, np.float32))
+        assert out.shape == shape, f"Output buffer must have shape {shape}"
+
+        missing = np.ones(len(self), dtype=bool)
+        missing[dst_ids] = False
+        out[..., missing, :] = np.nan
+        out[..., dst_ids, :] = data[..., src_ids, :]
+        return out
+
+
+montage_64 = Montage(CH_NAMES_64)
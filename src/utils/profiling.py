@@ -0,0 +1,309 @@
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+# spans are written as JSON lines to this path; pool workers inherit it
+TRACE_ENV = "EEG_TRACE_PATH"
+TRACEMALLOC_ENV = "EEG_TRACE_TRACEMALLOC"
+
+
+def _io_counters() -> Dict[str, int]:
+    # rchar counts bytes through read syscalls; read_bytes counts bytes fetched
+    # from storage, including page-ins of memory-mapped files (Linux only)
+    counters = {}
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                key, value = line.split(":")
+                if key in ("rchar", "read_bytes"):
+                    counters[key] = int(value)
+    except OSError:
+        pass
+    return counters
+
+
+def _page_faults() -> int:
+    # every first touch of a memory-mapped page faults, whether or not it is cached
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_minflt + usage.ru_majflt
+
+
+def _rss_kb() -> Dict[str, int]:
+    # current (VmRSS) and peak (VmHWM) resident set size (Linux only)
+    rss = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    rss[line[:5]] = int(line.split()[1])
+    except OSError:
+        pass
+    return rss
+
+
+def _reset_peak_rss() -> bool:
+    # resets VmHWM to the current RSS (Linux >= 4.0); False where not allowed
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed stage; use through Tracer.span
+
+    Besides wall and CPU time, a span records the resident set size at its
+    end and its change over the span, the span's own peak RSS (VmHWM is reset
+    on entry, so this is None where /proc/self/clear_refs is not writable),
+    bytes read from storage (read_bytes, which includes memmap page-ins) and
+    through read syscalls, and page faults, which count memmap pages touched
+    even when they come from the page cache. RSS is process-wide, so spans in
+    concurrent threads see each other's memory.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.peak_traced = 0
+        self.peak_rss_kb = 0
+
+    def set(self, **attrs):
+        """Attach attributes known only inside the span (e.g. trial counts)"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = self.tracer._stack()
+        self.depth = len(stack)
+        stack.append(self)
+        if self.tracer.trace_malloc:
+            if stack[:-1]:
+                # keep the enclosing span's peak before resetting it for this one
+                parent = stack[-2]
+                parent.peak_traced = max(parent.peak_traced, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        if stack[:-1]:
+            # same for the peak RSS, which is process-wide
+            parent = stack[-2]
+            parent.peak_rss_kb = max(parent.peak_rss_kb, _rss_kb().get("VmHWM", 0))
+        self.peak_rss_reset = _reset_peak_rss()
+        self.rss_start = _rss_kb().get("VmRSS")
+        self.io_start = _io_counters()
+        self.faults_start = _page_faults()
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        cpu_seconds = time.process_time() - self.cpu_start
+        page_faults = _page_faults() - self.faults_start
+        io_end = _io_counters()
+        rss = _rss_kb()
+        stack = self.tracer._stack()
+        stack.pop()
+
+        def io_delta(key):
+            if key not in io_end or key not in self.io_start:
+                return None
+            return io_end[key] - self.io_start[key]
+
+        peak_rss_mb = None
+        if self.peak_rss_reset and "VmHWM" in rss:
+            self.peak_rss_kb = max(self.peak_rss_kb, rss["VmHWM"])
+            peak_rss_mb = self.peak_rss_kb / 1024
+            if stack:
+                stack[-1].peak_rss_kb = max(stack[-1].peak_rss_kb, self.peak_rss_kb)
+        rss_end = rss.get("VmRSS")
+        rss_delta_mb = None
+        if rss_end is not None and self.rss_start is not None:
+            rss_delta_mb = (rss_end - self.rss_start) / 1024
+
+        record = {
+            "name": self.name,
+            "ts": self.tracer._wall_time(self.start),
+            "seconds": seconds,
+            "cpu_seconds": cpu_seconds,
+            "read_bytes": io_delta("read_bytes"),
+            "read_syscall_bytes": io_delta("rchar"),
+            "page_faults": page_faults,
+            "rss_mb": None if rss_end is None else rss_end / 1024,
+            "rss_delta_mb": rss_delta_mb,
+            "peak_rss_mb": peak_rss_mb,
+            "depth": self.depth,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            **self.attrs,
+        }
+        if self.tracer.trace_malloc:
+            self.peak_traced = max(self.peak_traced, tracemalloc.get_traced_memory()[1])
+            record["peak_traced_mb"] = self.peak_traced / 1024**2
+            if stack:
+                stack[-1].peak_traced = max(stack[-1].peak_traced, self.peak_traced)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        self.tracer._write(record)
+        return False
+
+
+class Tracer:
+    """Records spans as JSON lines; a disabled tracer hands out a shared no-op span
+
+    Enabling sets environment variables, so joblib/loky workers started
+    afterwards trace into the same file (each line carries its pid).
+    """
+
+    def __init__(self):
+        self.path = None
+        self.trace_malloc = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._origin = time.time() - time.perf_counter()
+        path = os.environ.get(TRACE_ENV)
+        if path:
+            self.enable(path, trace_malloc=os.environ.get(TRACEMALLOC_ENV) == "1")
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def enable(self, path: str, trace_malloc: bool = False):
+        """Append spans to path; trace_malloc adds peak Python allocations (slower)"""
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.trace_malloc = trace_malloc
+        if trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        os.environ[TRACE_ENV] = self.path
+        os.environ[TRACEMALLOC_ENV] = "1" if trace_malloc else "0"
+
+    def disable(self):
+        self.path = None
+        if self.trace_malloc and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_malloc = False
+        os.environ.pop(TRACE_ENV, None)
+        os.environ.pop(TRACEMALLOC_ENV, None)
+
+    def span(self, name: str, **attrs):
+        if self.path is None:
+            return _NULL_SPAN
+        return Span(self, name, attrs)
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _wall_time(self, perf_counter: float) -> float:
+        return self._origin + perf_counter
+
+    def _write(self, record: Dict):
+        line = json.dumps(record, default=str) + "\n"
+        # one write per line on an O_APPEND file, so processes do not interleave lines
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+tracer = Tracer()
+
+
+def span(name: str, **attrs):
+    """Context manager timing a stage: with span("tfr", subject_id=...): ..."""
+    return tracer.span(name, **attrs)
+
+
+def traced(name: Optional[str] = None, subject_arg: Optional[str] = "subject_id") -> Callable:
+    """Decorator wrapping a function in a span
+
+    If the function takes an argument called subject_arg, its value is recorded
+    with the span.
+    """
+
+    def decorator(fn):
+        span_name = name or fn.__qualname__
+        varnames = fn.__code__.co_varnames[: fn.__code__.co_argcount]
+        position = varnames.index(subject_arg) if subject_arg in varnames else None
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if tracer.path is None:
+                return fn(*args, **kwargs)
+            attrs = {}
+            if position is not None:
+                value = args[position] if position < len(args) else kwargs.get(subject_arg)
+                if value is not None:
+                    attrs[subject_arg] = value
+            with tracer.span(span_name, **attrs):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def read_spans(path: str) -> List[Dict]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def to_chrome_trace(jsonl_path: str, output_path: str) -> str:
+    """Convert a span log to Chrome trace format (chrome://tracing, Perfetto)"""
+    spans = read_spans(jsonl_path)
+    events = []
+    for record in spans:
+        args = {
+            key: value
+            for key, value in record.items()
+            if key not in ("name", "ts", "seconds", "pid", "tid", "depth")
+        }
+        events.append(
+            {
+                "name": record["name"],
+                "ph": "X",
+                "ts": record["ts"] * 1e6,
+                "dur": record["seconds"] * 1e6,
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": args,
+            }
+        )
+    with open(output_path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return output_path
+
+
+def summarize_spans(path: str):
+    """Total wall time per stage and per subject, largest first"""
+    import pandas as pd
+
+    spans = pd.DataFrame(read_spans(path))
+    if "subject_id" not in spans:
+        spans["subject_id"] = None
+    return (
+        spans.groupby(["name", "subject_id"], dropna=False)[["seconds", "cpu_seconds"]]
+        .sum()
+        .sort_values("seconds", ascending=False)
+    )
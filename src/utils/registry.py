@@ -0,0 +1,86 @@
+import os
+from fnmatch import fnmatchcase
+from typing import Dict, List, Optional, Set, Tuple
+
+from src.configs.config import CFGLog
+
+
+class SubjectRegistry:
+    """Subject -> (study, group) index built once from the study entries in CFGLog
+
+    A subject can belong to several groups (e.g. CP and WSP), and the same ID
+    may appear in more than one study.
+    """
+
+    def __init__(self, cfg: Dict = CFGLog):
+        self.studies = [key for key, value in cfg.items() if "subject_ids" in value]
+        self._members: Dict[Tuple[str, str], Set[str]] = {}
+        self._group_ids: Dict[Tuple[str, str], List[str]] = {}
+        self._index: Dict[str, List[Tuple[str, str]]] = {}
+        for study in self.studies:
+            for group, subject_ids in cfg[study]["subject_ids"].items():
+                self._members[(study, group)] = set(subject_ids)
+                self._group_ids[(study, group)] = list(subject_ids)
+                for subject_id in subject_ids:
+                    memberships = self._index.setdefault(subject_id, [])
+                    if (study, group) not in memberships:
+                        memberships.append((study, group))
+
+    def __contains__(self, subject_id: str) -> bool:
+        return subject_id in self._index
+
+    def groups(self, subject_id: str, study: Optional[str] = None) -> List[str]:
+        """Every group the subject belongs to, in config order"""
+        return [
+            group
+            for this_study, group in self._index.get(subject_id, [])
+            if study is None or this_study == study
+        ]
+
+    def group(self, subject_id: str, study: Optional[str] = None) -> Optional[str]:
+        """First group the subject belongs to (e.g. CP before WSP), or None"""
+        groups = self.groups(subject_id, study)
+        return groups[0] if groups else None
+
+    def in_group(self, subject_id: str, group: str, study: str) -> bool:
+        return subject_id in self._members.get((study, group), ())
+
+    def subject_ids(self, group: str, study: str) -> List[str]:
+        return list(self._group_ids.get((study, group), []))
+
+
+class FileCatalog:
+    """Cached listing of data directories, rescanned only when a directory's mtime changes"""
+
+    def __init__(self):
+        self._listings: Dict[str, Tuple[int, List[str]]] = {}
+
+    def _names(self, root: str) -> List[str]:
+        root = str(root)
+        try:
+            mtime = os.stat(root).st_mtime_ns
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Data directory does not exist: {root}")
+        cached = self._listings.get(root)
+        if cached is None or cached[0] != mtime:
+            with os.scandir(root) as entries:
+                names = sorted(entry.name for entry in entries)
+            cached = self._listings[root] = (mtime, names)
+        return cached[1]
+
+    def glob(self, root: str, pattern: str) -> List[str]:
+        return [
+            os.path.join(str(root), name)
+            for name in self._names(root)
+            if fnmatchcase(name, pattern)
+        ]
+
+    def find(self, root: str, pattern: str) -> str:
+        """First file in root matching pattern; raises FileNotFoundError if none"""
+        matches = self.glob(root, pattern)
+        if not matches:
+            raise FileNotFoundError(f"No file matching '{pattern}' in {root}")
+        return matches[0]
+
+
+registry = SubjectRegistry(CFGLog)
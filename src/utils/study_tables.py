@@ -0,0 +1,258 @@
+import logging
+import os
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+
+from src.configs.config import CFGLog
+from src.utils.file_handling import ArrayStore
+
+logger = logging.getLogger(__name__)
+
+# the subject-ID column is written last; its manifest marks a complete table
+INDEX = "index"
+
+
+def _column_name(i: int) -> str:
+    # column names come from spreadsheet headers, so files are named by position
+    return f"col{i:03d}"
+
+
+def parse_table(
+    fname: str,
+    id_column: Optional[str] = None,
+    dtypes: Optional[Dict[str, str]] = None,
+    categorical: Sequence[str] = (),
+):
+    """Read a study CSV (or Excel sheet) into a DataFrame with explicit dtypes
+
+    The subject-ID column (id_column, or the first column) is read as text so
+    IDs such as "018" keep their leading zeros. dtypes overrides the inferred
+    dtype of any column; text columns and those listed in categorical become
+    pandas Categoricals.
+    """
+    import pandas as pd
+
+    read = pd.read_excel if fname.endswith((".xlsx", ".xls")) else pd.read_csv
+    header = read(fname, nrows=0).columns
+    id_column = header[0] if id_column is None else id_column
+    assert id_column in header, f"{fname} has no {id_column} column"
+    table = read(fname, dtype={id_column: str, **(dtypes or {})})
+    table[id_column] = table[id_column].str.strip()
+    table = table.set_index(id_column)
+    assert table.index.is_unique, f"Duplicate subject IDs in {fname}"
+
+    for column in table.columns:
+        # anything not numeric or boolean (text, dates, mixed) is stored as codes
+        if column in categorical or not pd.api.types.is_numeric_dtype(table[column]):
+            table[column] = table[column].astype("category")
+    return table
+
+
+def _mask_name(i: int) -> str:
+    return f"{_column_name(i)}_mask"
+
+
+def _categories(categories) -> List:
+    # numeric categories stay numbers; anything else is kept as text in the manifest
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(categories):
+        return categories.tolist()
+    return categories.astype(str).tolist()
+
+
+class StudyTables:
+    """Columnar binary cache of the subject-level table of every study in CFGLog
+
+    Each study's `path` file is parsed once; every column is then stored as a
+    flat array in an ArrayStore under tables/<study> (categorical columns as
+    int32 codes with their categories in the manifest) and is rebuilt when
+    the source file changes. Reads map only the requested columns, so
+    projecting and filtering a table costs milliseconds.
+    """
+
+    def __init__(
+        self,
+        cache_path: str,
+        cfg: Dict = CFGLog,
+        id_column: Optional[str] = None,
+        dtypes: Optional[Dict[str, str]] = None,
+        categorical: Sequence[str] = (),
+    ):
+        self.store = ArrayStore(cache_path)
+        self.paths = {key: value["path"] for key, value in cfg.items() if "path" in value}
+        self.id_column = id_column
+        self.dtypes = dtypes
+        self.categorical = tuple(categorical)
+
+    @property
+    def studies(self) -> List[str]:
+        return list(self.paths)
+
+    def _key(self, study: str) -> str:
+        return os.path.join("tables", study)
+
+    def _build(self, study: str) -> Dict:
+        import pandas as pd
+
+        fname = self.paths[study]
+        table = parse_table(fname, self.id_column, self.dtypes, self.categorical)
+        key = self._key(study)
+        for i, column in enumerate(table.columns):
+            values = table[column]
+            if values.dtype.name == "category":
+                # NaN is code -1, as in pandas
+                self.store.write(
+                    key,
+                    _column_name(i),
+                    values.cat.codes.to_numpy(np.int32),
+                    [fname],
+                    column=str(column),
+                    categories=_categories(values.cat.categories),
+                )
+            elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+                # nullable dtypes (Int64, Float64, boolean): values with NA as 0
+                # plus a boolean mask, so the dtype survives the round trip
+                assert hasattr(values.dtype, "numpy_dtype"), (
+                    f"Cannot cache column {column} of {fname} with dtype {values.dtype}"
+                )
+                self.store.write(
+                    key,
+                    _column_name(i),
+                    values.to_numpy(values.dtype.numpy_dtype, na_value=0),
+                    [fname],
+                    column=str(column),
+                    nullable=values.dtype.name,
+                )
+                self.store.write(key, _mask_name(i), values.isna().to_numpy(), [fname])
+            else:
+                self.store.write(
+                    key, _column_name(i), values.to_numpy(), [fname], column=str(column)
+                )
+        subject_ids = table.index.to_numpy(str)
+        return self.store.write(
+            key,
+            INDEX,
+            subject_ids,
+            [fname],
+            id_column=str(table.index.name),
+            columns=[str(column) for column in table.columns],
+        )
+
+    def schema(self, study: str) -> Dict:
+        """Manifest of the cached table, parsing the source file first if it is stale"""
+        key = self._key(study)
+        if not self.store.is_fresh(key, INDEX, [self.paths[study]]):
+            logger.info("Parsing %s", self.paths[study])
+            return self._build(study)
+        return self.store.read_manifest(key, INDEX)
+
+    def columns(
+        self,
+        study: str,
+        columns: Optional[Sequence[str]] = None,
+        subject_ids: Optional[Sequence[str]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """Selected columns as numpy arrays, keyed by name, plus the subject IDs
+
+        Categorical columns come back as int32 codes; their categories are in
+        schema(study). Nullable columns (Int64, boolean, ...) come back as
+        numpy masked arrays, masked where the value is NA. Rows follow the order of subject_ids; IDs missing
+        from the study are dropped with a warning.
+        """
+        schema = self.schema(study)
+        key = self._key(study)
+        all_ids = self.store.read(key, INDEX)[0]
+        if subject_ids is None:
+            rows = slice(None)
+        else:
+            position = {subject_id: i for i, subject_id in enumerate(all_ids)}
+            missing = [subject_id for subject_id in subject_ids if subject_id not in position]
+            if missing:
+                logger.warning("%s subjects not in %s: %s", len(missing), study, missing)
+            rows = np.array(
+                [position[subject_id] for subject_id in subject_ids if subject_id in position],
+                dtype=np.int64,
+            )
+
+        names = schema["columns"] if columns is None else list(columns)
+        unknown = set(names) - set(schema["columns"])
+        assert not unknown, f"{study} has no columns {sorted(unknown)}"
+        data = {schema["id_column"]: np.asarray(all_ids[rows])}
+        for column in names:
+            i = schema["columns"].index(column)
+            values, manifest = self.store.read(key, _column_name(i))
+            if "nullable" in manifest:
+                mask, _ = self.store.read(key, _mask_name(i))
+                data[column] = np.ma.MaskedArray(values[rows], mask[rows])
+            else:
+                data[column] = np.asarray(values[rows])
+        return data
+
+    def load(
+        self,
+        study: str,
+        columns: Optional[Sequence[str]] = None,
+        subject_ids: Optional[Sequence[str]] = None,
+    ):
+        """Selected columns as a DataFrame indexed by subject ID, categoricals and
+        nullable dtypes restored"""
+        import pandas as pd
+
+        schema = self.schema(study)
+        data = self.columns(study, columns, subject_ids)
+        index = pd.Index(data.pop(schema["id_column"]), name=schema["id_column"])
+        frame = {}
+        for column, values in data.items():
+            manifest = self.store.read_manifest(
+                self._key(study), _column_name(schema["columns"].index(column))
+            )
+            if "categories" in manifest:
+                values = pd.Categorical.from_codes(values, manifest["categories"])
+            elif "nullable" in manifest:
+                mask = values.mask
+                values = pd.array(values.data, dtype=manifest["nullable"])
+                values[mask] = pd.NA
+            frame[column] = values
+        return pd.DataFrame(frame, index=index)
+
+    def load_all(
+        self,
+        columns: Optional[Sequence[str]] = None,
+        subject_ids: Optional[Sequence[str]] = None,
+    ):
+        """Every study with a table on disk, stacked with a categorical study column
+
+        When columns is None, only the columns every study has are kept.
+        Raises FileNotFoundError when no study has its table on disk.
+        """
+        import pandas as pd
+
+        studies = [study for study, fname in self.paths.items() if os.path.isfile(fname)]
+        for study in set(self.studies) - set(studies):
+            logger.warning("No table for %s at %s", study, self.paths[study])
+        if not studies:
+            raise FileNotFoundError(
+                f"No study tables found; looked for {sorted(self.paths.values())}"
+            )
+        schemas = {study: self.schema(study) for study in studies}
+        if columns is None:
+            shared = set.intersection(*(set(schema["columns"]) for schema in schemas.values()))
+            columns = [c for c in schemas[studies[0]]["columns"] if c in shared]
+
+        frames = []
+        for study in studies:
+            ids = None
+            if subject_ids is not None:
+                present = set(self.store.read(self._key(study), INDEX)[0].tolist())
+                ids = [subject_id for subject_id in subject_ids if subject_id in present]
+            frame = self.load(study, columns, ids)
+            frame.insert(0, "study", study)
+            frames.append(frame)
+        table = pd.concat(frames)
+        # concat turns categoricals with different categories into objects
+        for column in table.columns:
+            if not pd.api.types.is_numeric_dtype(table[column]):
+                table[column] = table[column].astype("category")
+        table["study"] = table["study"].cat.set_categories(self.studies)
+        return table
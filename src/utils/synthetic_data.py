@@ -0,0 +1,145 @@
+import os
+import pickle
+import scipy.io as sio
+import numpy as np
+import mne
+from typing import Dict, List, Tuple
+
+from src.utils.montage import CH_NAMES_64
+
+# stim_labels.mat codes drawn for each trial; 3 (hand) is what the loaders select
+STIM_LABELS = (3, 4, 5, 6, 7, 8)
+STIM_LABEL_P = (0.35, 0.15, 0.1, 0.2, 0.1, 0.1)
+
+
+def _pink_noise(rng: np.random.Generator, shape: Tuple[int, ...], sfreq: float) -> np.ndarray:
+    # 1/f noise along the last axis, unit variance
+    n_times = shape[-1]
+    spectrum = rng.normal(size=shape[:-1] + (n_times // 2 + 1,)) + 1j * rng.normal(
+        size=shape[:-1] + (n_times // 2 + 1,)
+    )
+    freqs = np.fft.rfftfreq(n_times, 1 / sfreq)
+    spectrum /= np.sqrt(np.maximum(freqs, freqs[1]))
+    noise = np.fft.irfft(spectrum, n=n_times, axis=-1)
+    return noise / noise.std(axis=-1, keepdims=True)
+
+
+def _evoked_response(times: np.ndarray, latency: float, width: float, freq: float) -> np.ndarray:
+    # Gabor burst after stimulus onset
+    envelope = np.exp(-0.5 * ((times - latency) / width) ** 2)
+    return envelope * np.cos(2 * np.pi * freq * (times - latency))
+
+
+def make_subject(
+    subject_id: str,
+    processed_data_path: str,
+    zscored_epochs_data_path: str,
+    n_trials: int = 60,
+    n_rois: int = 12,
+    sfreq: float = 400,
+    tmin: float = -2.5,
+    tmax: float = 2.5,
+    n_missing_channels: int = 0,
+    resting_seconds: float = 300,
+    resting_path: str = None,
+    seed: int = 0,
+) -> Dict[str, str]:
+    """Write one fake subject in the layout SubjectProcessor reads
+
+    {subject_id}_preprocessed-epo.fif (64 channels, minus n_missing_channels),
+    {subject_id}_stim_labels.mat and an {subject_id}_epochs.pkl list of
+    (n_rois, n_times) STC epochs, plus an {subject_id}_eyes_open.pkl
+    (n_rois, n_resting_times) resting STC in resting_path if given. Returns the
+    written file names.
+    """
+    rng = np.random.default_rng(seed)
+    times = np.arange(int(round(tmin * sfreq)), int(round(tmax * sfreq)) + 1) / sfreq
+
+    stim_labels = rng.choice(STIM_LABELS, size=n_trials, p=STIM_LABEL_P)
+    stim_labels[: min(3, n_trials)] = 3  # every subject has some hand trials
+    response = _evoked_response(times, latency=0.2, width=0.05, freq=8.0)
+    is_hand = (stim_labels == 3)[:, None, None]
+
+    ch_names = list(CH_NAMES_64)
+    if n_missing_channels:
+        drop = rng.choice(len(ch_names), size=n_missing_channels, replace=False)
+        ch_names = [name for i, name in enumerate(ch_names) if i not in set(drop)]
+    eeg = _pink_noise(rng, (n_trials, len(ch_names), len(times)), sfreq)
+    eeg += is_hand * rng.uniform(0.5, 2.0, size=(1, len(ch_names), 1)) * response
+    eeg *= 1e-5  # volts
+
+    stc = _pink_noise(rng, (n_trials, n_rois, len(times)), sfreq)
+    stc += is_hand * rng.uniform(0.5, 2.0, size=(1, n_rois, 1)) * response
+
+    fnames = {
+        "epochs": os.path.join(processed_data_path, f"{subject_id}_preprocessed-epo.fif"),
+        "stim_labels": os.path.join(processed_data_path, f"{subject_id}_stim_labels.mat"),
+        "stc_epochs": os.path.join(zscored_epochs_data_path, f"{subject_id}_epochs.pkl"),
+    }
+    info = mne.create_info(ch_names=ch_names, sfreq=sfreq, ch_types="eeg")
+    mne.EpochsArray(eeg, info, tmin=times[0], verbose=False).save(
+        fnames["epochs"], overwrite=True, verbose=False
+    )
+    sio.savemat(fnames["stim_labels"], {"stim_labels": stim_labels[np.newaxis]})
+    with open(fnames["stc_epochs"], "wb") as f:
+        pickle.dump(list(stc), f)
+
+    if resting_path is not None and resting_seconds > 0:
+        # 1/f background with a ROI-specific alpha rhythm
+        n_resting = int(resting_seconds * sfreq)
+        resting = _pink_noise(rng, (n_rois, n_resting), sfreq)
+        alpha = np.sin(2 * np.pi * rng.uniform(8, 12, size=(n_rois, 1)) * np.arange(n_resting) / sfreq)
+        resting += rng.uniform(0.2, 1.0, size=(n_rois, 1)) * alpha
+        fnames["eo_resting"] = os.path.join(resting_path, f"{subject_id}_eyes_open.pkl")
+        with open(fnames["eo_resting"], "wb") as f:
+            pickle.dump(resting, f)
+    return fnames
+
+
+def make_cohort(
+    root: str,
+    n_subjects: int = 4,
+    n_trials: int = 60,
+    n_rois: int = 12,
+    sfreq: float = 400,
+    tmin: float = -2.5,
+    tmax: float = 2.5,
+    missing_channels_every: int = 0,
+    resting_seconds: float = 300,
+    seed: int = 0,
+) -> Tuple[Dict[str, str], List[str]]:
+    """Write a fake cohort under root; returns a SubjectProcessor paths_dict and subject IDs
+
+    Every missing_channels_every-th subject is recorded without two channels,
+    so the montage alignment path is exercised too.
+    """
+    paths_dict = {
+        "processed_data_path": os.path.join(root, "Processed Data"),
+        "stc_path": os.path.join(root, "Source Time Courses (MNE)"),
+        "EO_resting_data_path": os.path.join(root, "Source Time Courses (MNE)", "Eyes Open"),
+        "zscored_epochs_data_path": os.path.join(
+            root, "Source Time Courses (MNE)", "zscored_Epochs"
+        ),
+        "cache_path": os.path.join(root, "array_cache"),
+    }
+    for key in ["processed_data_path", "EO_resting_data_path", "zscored_epochs_data_path"]:
+        os.makedirs(paths_dict[key], exist_ok=True)
+
+    subject_ids = [f"SYN{i:03d}" for i in range(n_subjects)]
+    for i, subject_id in enumerate(subject_ids):
+        missing = missing_channels_every and i % missing_channels_every == missing_channels_every - 1
+        make_subject(
+            subject_id,
+            paths_dict["processed_data_path"],
+            paths_dict["zscored_epochs_data_path"],
+            n_trials=n_trials,
+            n_rois=n_rois,
+            sfreq=sfreq,
+            tmin=tmin,
+            tmax=tmax,
+            n_missing_channels=2 if missing else 0,
+            resting_seconds=resting_seconds,
+            resting_path=paths_dict["EO_resting_data_path"],
+            seed=seed + i,
+        )
+    return paths_dict, subject_ids
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import numpy as np
+from collections import OrderedDict
+from typing import TYPE_CHECKING, List, Optional
+
+from src.utils.file_handling import ArrayStore
+
+if TYPE_CHECKING:
+    from mne.time_frequency import AverageTFRArray
+
+
+class TFRCache:
+    """Two-tier AverageTFRArray cache: an in-process LRU with a byte budget, then disk"""
+
+    def __init__(self, cache_path: Optional[str] = None, max_bytes: int = 2 * 1024**3):
+        self.max_bytes = max_bytes
+        self.store = ArrayStore(cache_path) if cache_path is not None else None
+        self._memory = OrderedDict()
+        self._nbytes = 0
+
+    def __getstate__(self):
+        # only the disk tier is sent to pool workers; the LRU can hold gigabytes
+        state = self.__dict__.copy()
+        state["_memory"] = OrderedDict()
+        state["_nbytes"] = 0
+        return state
+
+    @staticmethod
+    def make_key(
+        subject_ids: List[str],
+        data: np.ndarray,
+        freqs: np.ndarray,
+        n_cycles: np.ndarray,
+        sfreq: float,
+        dtype=np.float64,
+    ) -> str:
+        key = hashlib.sha1()
+        key.update(json.dumps(list(subject_ids)).encode())
+        data = np.ascontiguousarray(data)
+        key.update(f"{data.shape}{data.dtype.str}".encode())
+        key.update(data.tobytes())
+        key.update(np.ascontiguousarray(freqs, dtype=np.float64).tobytes())
+        key.update(np.ascontiguousarray(n_cycles, dtype=np.float64).tobytes())
+        key.update(repr(float(sfreq)).encode())
+        if np.dtype(dtype) != np.float64:  # float64 keys are unchanged
+            key.update(np.dtype(dtype).str.encode())
+        return key.hexdigest()
+
+    def get(self, key: str) -> Optional["AverageTFRArray"]:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if self.store is None or not self.store.is_fresh("tfr", key, []):
+            return None
+
+        from mne import create_info
+        from mne.time_frequency import AverageTFRArray
+
+        data, meta = self.store.read("tfr", key)
+        info = create_info(ch_names=meta["ch_names"], sfreq=meta["sfreq"], ch_types="eeg")
+        tfr = AverageTFRArray(
+            info=info,
+            data=np.array(data),
+            times=np.array(meta["times"]),
+            freqs=np.array(meta["freqs"]),
+            nave=meta["nave"],
+        )
+        self._remember(key, tfr)
+        return tfr
+
+    def put(self, key: str, tfr: "AverageTFRArray") -> None:
+        self._remember(key, tfr)
+        if self.store is not None:
+            self.store.write(
+                "tfr",
+                key,
+                tfr.data,
+                ch_names=tfr.info["ch_names"],
+                sfreq=tfr.info["sfreq"],
+                times=tfr.times.tolist(),
+                freqs=tfr.freqs.tolist(),
+                nave=int(tfr.nave),
+            )
+
+    def _remember(self, key: str, tfr: "AverageTFRArray") -> None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = tfr
+        self._nbytes += tfr.data.nbytes
+        # evict least recently used entries, but always keep the newest one
+        while self._nbytes > self.max_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._nbytes -= evicted.data.nbytes
@@ -0,0 +1,313 @@
+import html
+import logging
+import os
+import numpy as np
+from joblib import Parallel, delayed
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from src.analysis.statistical_analysis import (
+    bootstrap_ci,
+    compare_groups,
+    significance_mask,
+    subject_power_tensors,
+)
+from src.analysis.tfr import zscore_tfr
+from src.utils.profiling import span, traced
+
+logger = logging.getLogger(__name__)
+
+# figures are drawn on Figure/FigureCanvasAgg directly, never through pyplot,
+# so rendering is headless and no window or global figure state is involved
+
+
+def _save(fig: Figure, fname: str, dpi: int):
+    FigureCanvasAgg(fig)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    fig.savefig(fname, dpi=dpi)
+
+
+@traced("render_tfr", subject_arg=None)
+def render_tfr(
+    zpower: np.ndarray,
+    times: np.ndarray,
+    freqs: np.ndarray,
+    roi_acronyms: List[str],
+    title: str,
+    fname: str,
+    orientation: str = "horizontal",
+    vlim: Tuple[Optional[float], Optional[float]] = (None, None),
+    dpi: int = 150,
+    mask: Optional[np.ndarray] = None,
+    cbar_label: str = "z-score",
+) -> str:
+    """One panel per ROI with imshow and a single colorbar shared by all panels
+
+    mask, a boolean (n_rois, n_freqs, n_times) array such as significant
+    clusters, is outlined on top of each panel.
+    """
+    if orientation == "vertical":
+        n_rows, n_cols, figsize = 6, 2, (12, 16)
+    elif orientation == "horizontal":
+        n_rows, n_cols, figsize = 2, 6, (22, 6)
+    fig = Figure(figsize=figsize)
+    axes = fig.subplots(n_rows, n_cols, sharey=True, squeeze=False)
+
+    vmax = np.nanmax(np.abs(zpower)) if vlim[1] is None else vlim[1]
+    vmin = -vmax if vlim[0] is None else vlim[0]
+    dt = np.median(np.diff(times)) / 2.0
+    df = np.median(np.diff(freqs)) / 2.0
+    extent = [times[0] - dt, times[-1] + dt, freqs[0] - df, freqs[-1] + df]
+
+    for i, roi in enumerate(roi_acronyms):
+        col = i // 6 if orientation == "vertical" else i % 6
+        row = i % 6 if orientation == "vertical" else i // 6
+        ax = axes[row, col]
+        im = ax.imshow(
+            zpower[i],
+            origin="lower",
+            aspect="auto",
+            extent=extent,
+            interpolation="nearest",
+            cmap="turbo",
+            vmin=vmin,
+            vmax=vmax,
+        )
+        if mask is not None and mask[i].any():
+            # same extent and origin as imshow, so the outline follows its pixels
+            ax.contour(
+                mask[i].astype(float),
+                levels=[0.5],
+                origin="lower",
+                extent=extent,
+                colors="black",
+                linewidths=1.5,
+            )
+        ax.axvline(x=0, color="red", linestyle="--")
+        ax.set_title(roi)
+        ax.set_yticks([0, 20, 40, 60, 80, 100])
+        if col == 0:
+            ax.set_ylabel("Frequency (Hz)")
+        if row == n_rows - 1:
+            ax.set_xlabel("Time (s)")
+
+    fig.suptitle(title)
+    fig.tight_layout(rect=(0, 0, 0.95, 1))
+    cbar = fig.colorbar(im, ax=axes, fraction=0.02, pad=0.01)
+    cbar.set_label(cbar_label)
+    _save(fig, fname, dpi)
+    return fname
+
+
+@traced("render_trace", subject_arg=None)
+def render_trace(
+    evoked: np.ndarray,
+    lower: np.ndarray,
+    upper: np.ndarray,
+    times: np.ndarray,
+    channel: str,
+    title: str,
+    fname: str,
+    time_range: Tuple[float, float] = (-0.2, 0.8),
+    dpi: int = 150,
+    band_label: str = "95% bootstrap CI",
+) -> str:
+    """Grand-average ERP of one channel with a shaded band between lower and upper"""
+    keep = (times >= time_range[0]) & (times <= time_range[1])
+    evoked, lower, upper = evoked[keep] * 1e7, lower[keep] * 1e7, upper[keep] * 1e7
+
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.plot(times[keep], evoked, label=f"Channel {channel}")
+    ax.fill_between(times[keep], lower, upper, color="b", alpha=0.4, label=band_label)
+    ax.axvline(x=0, color="red", linestyle="--", label="Stimulus Onset")
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Amplitude (µV)")
+    ax.set_title(title)
+    ax.set_xlim(time_range)
+    ax.legend()
+    fig.tight_layout()
+    _save(fig, fname, dpi)
+    return fname
+
+
+def write_index(
+    output_path: str,
+    figures: Dict[str, Dict[str, str]],
+    columns: List[str],
+    title: str = "TFR reports",
+) -> str:
+    """HTML table of figures, one row per group and one column per figure kind"""
+    rows = []
+    for group, group_figures in figures.items():
+        cells = []
+        for column in columns:
+            fname = group_figures.get(column)
+            if fname is None:
+                cells.append("<td></td>")
+                continue
+            src = html.escape(quote(os.path.relpath(fname, output_path)))
+            cells.append(f'<td><a href="{src}"><img src="{src}" width="360"></a></td>')
+        rows.append(f"<tr><th>{html.escape(group)}</th>{''.join(cells)}</tr>")
+    header = "".join(f"<th>{html.escape(column)}</th>" for column in columns)
+    index_fname = os.path.join(output_path, "index.html")
+    with open(index_fname, "w") as f:
+        f.write(
+            f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head>\n"
+            f"<body><h1>{html.escape(title)}</h1>\n<table>\n<tr><th></th>{header}</tr>\n"
+            + "\n".join(rows)
+            + "\n</table></body></html>\n"
+        )
+    return index_fname
+
+
+def generate_reports(
+    visualizer,
+    groups: Dict[str, object],
+    output_path: str,
+    baselines: List[Tuple[float, float]] = ((-2.5, 0.0),),
+    orientations: List[str] = ("horizontal", "vertical"),
+    channel: str = "Fp1",
+    time_range: Tuple[float, float] = (-0.2, 0.8),
+    vlim: Tuple[Optional[float], Optional[float]] = (None, None),
+    dpi: int = 150,
+    n_jobs: int = 1,
+    comparisons: Optional[Dict[str, Tuple[str, str]]] = None,
+    n_permutations: int = 5000,
+    alpha: float = 0.05,
+    n_resamples: int = 10000,
+) -> str:
+    """Render every group x baseline x orientation TFR figure plus each group's ERP trace
+
+    Group data and TFRs come from the visualizer (a Visualizer mixed into a
+    SubjectProcessor), loaded with n_jobs workers and cached as usual. Each
+    group's power is z-scored once per baseline for all ROIs; figures are then
+    rendered off-screen in n_jobs worker processes. Returns the index.html path.
+
+    comparisons maps a row name to a pair of group names; each pair gets a
+    cluster permutation test per baseline, drawn as a t map with the clusters
+    significant at alpha outlined. ERP bands are 95% bootstrap intervals
+    over subjects from n_resamples resamples.
+    """
+    jobs = []
+    figures = {}
+    for group_name, subjects in groups.items():
+        complete_data = visualizer._load_complete_data(subjects, n_jobs=n_jobs, resting=False)
+        tfr = visualizer._compute_tfr(subjects, complete_data=complete_data)
+        epochs, evoked_data_arrays, sem_epochs_per_sub, _, _ = complete_data
+        power, times, freqs = tfr.get_data(), tfr.times, tfr.freqs
+        figures[group_name] = {}
+
+        for baseline in baselines:
+            with span("zscore_tfr", group=group_name, baseline=list(baseline)):
+                zpower, ztimes = zscore_tfr(power, times, baseline, time_range)
+            for orientation in orientations:
+                column = f"TFR {baseline} {orientation}"
+                fname = os.path.join(
+                    output_path, f"{baseline}", f"{group_name}_epochs_tfr_{orientation}.png"
+                )
+                title = f"Time-Frequency Representation of Group-Averaged Evoked Response ({group_name})"
+                figures[group_name][column] = fname
+                jobs.append(
+                    delayed(render_tfr)(
+                        zpower,
+                        ztimes,
+                        freqs,
+                        visualizer.roi_acronyms,
+                        title,
+                        fname,
+                        orientation,
+                        vlim,
+                        dpi,
+                    )
+                )
+
+        ch_names = [name.upper() for name in epochs.info["ch_names"]]
+        ch = ch_names.index(channel.upper())
+        evoked = np.nanmean(evoked_data_arrays[:, ch], axis=0)
+        if len(evoked_data_arrays) > 1:
+            with span("trace_ci", group=group_name):
+                lower, upper = bootstrap_ci(evoked_data_arrays[:, ch], n_resamples=n_resamples)
+            band_label = "95% bootstrap CI"
+        else:
+            sem = sem_epochs_per_sub[0, ch]
+            lower, upper, band_label = evoked - sem, evoked + sem, "SEM"
+        fname = os.path.join(output_path, f"{group_name}_epochs_trace.png")
+        figures[group_name]["ERP"] = fname
+        jobs.append(
+            delayed(render_trace)(
+                evoked,
+                lower,
+                upper,
+                epochs.times,
+                channel,
+                f"Grand Average ERP (Group-Averaged {group_name})",
+                fname,
+                time_range,
+                dpi,
+                band_label,
+            )
+        )
+
+    # each group's per-subject TFR power is computed once and z-scored per baseline
+    group_power = {}
+    for comparison, (group1, group2) in (comparisons or {}).items():
+        figures[comparison] = {}
+        for group_name in (group1, group2):
+            if group_name not in group_power:
+                with span("subject_power", group=group_name):
+                    group_power[group_name] = subject_power_tensors(
+                        visualizer,
+                        [subject.subject_id for subject in groups[group_name].subjects],
+                        n_jobs=n_jobs,
+                    )
+        times = group_power[group1][1]
+        for baseline in baselines:
+            with span("cluster_test", comparison=comparison, baseline=list(baseline)):
+                result = compare_groups(
+                    visualizer,
+                    groups[group1],
+                    groups[group2],
+                    baseline=baseline,
+                    time_range=time_range,
+                    n_permutations=n_permutations,
+                    n_jobs=n_jobs,
+                    power=(group_power[group1][0], group_power[group2][0], times),
+                )
+            n_significant = sum(cluster["p_value"] < alpha for cluster in result["clusters"])
+            logger.info("%s %s: %d significant clusters", comparison, baseline, n_significant)
+            for orientation in orientations:
+                column = f"TFR {baseline} {orientation}"
+                fname = os.path.join(
+                    output_path, f"{baseline}", f"{comparison}_cluster_test_{orientation}.png"
+                )
+                title = f"{group1} vs {group2}: t values, clusters with p < {alpha} outlined"
+                figures[comparison][column] = fname
+                jobs.append(
+                    delayed(render_tfr)(
+                        result["t_obs"],
+                        result["times"],
+                        result["freqs"],
+                        visualizer.roi_acronyms,
+                        title,
+                        fname,
+                        orientation,
+                        (None, None),
+                        dpi,
+                        significance_mask(result, alpha),
+                        "t value",
+                    )
+                )
+
+    logger.info("Rendering %d figures", len(jobs))
+    with span("render_reports", n_figures=len(jobs), n_jobs=n_jobs):
+        Parallel(n_jobs=n_jobs)(jobs)
+
+    columns = [
+        f"TFR {baseline} {orientation}" for baseline in baselines for orientation in orientations
+    ] + ["ERP"]
+    index_fname = write_index(output_path, figures, columns)
+    logger.info("Wrote %s", index_fname)
+    return index_fname
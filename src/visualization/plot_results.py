@@ -1,16 +1,29 @@
-from glob import glob
-import pickle
-import scipy.io as sio
+import functools
+import hashlib
 import numpy as np
-import matplotlib.pyplot as plt
-import mne
 import os
-from mne.time_frequency import tfr_array_morlet, AverageTFRArray
-import seaborn as sns
-from typing import Dict, List, Union
-from IPython.display import clear_output
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Union
 
-sns.set(style="white", font_scale=1.5)
+from src.analysis.tfr import MorletTFR
+from src.preprocessing.processor import Subject, SubjectGroup
+from src.utils.config import get_dtype
+from src.utils.profiling import span, traced
+from src.utils.tfr_cache import TFRCache
+
+if TYPE_CHECKING:
+    from mne.time_frequency import AverageTFRArray
+
+# mne, matplotlib and seaborn are imported where a figure or MNE object is
+# made, so importing the Visualizer (e.g. in pool workers) stays cheap
+
+
+@functools.lru_cache(maxsize=None)
+def _set_style():
+    # the seaborn style the figures were designed with, applied on first render
+    import seaborn as sns
+
+    sns.set(style="white", font_scale=1.5)
 
 
 class Visualizer:
@@ -22,6 +35,9 @@ class Visualizer:
         freq_bands: Dict[str, List[int]],
         output_path: str,
         model_name: str,
+        tfr_cache_path: str = None,
+        tfr_cache_bytes: int = 2 * 1024**3,
+        precision: str = "float64",
     ):
         self.sfreq = sfreq
         self.roi_names = roi_names
@@ -32,26 +48,56 @@ class Visualizer:
         self.yes_list = []
         self.no_list = []
         self.maybe_list = []
+        self.tfr_cache = TFRCache(tfr_cache_path, max_bytes=tfr_cache_bytes)
+        self.dtype = get_dtype(precision)  # float32 runs the wavelets in complex64
+        # bootstrap ERP bands of recent groups, so re-plots and other channels reuse them
+        self.trace_ci_cache = OrderedDict()
+        self.trace_ci_cache_size = 8
 
+    def __getstate__(self):
+        # bound methods dispatched to pool workers pickle the whole instance, so
+        # leave the in-memory caches behind (tfr_cache keeps only its disk tier)
+        state = self.__dict__.copy()
+        state["trace_ci_cache"] = OrderedDict()
+        return state
 
-    def _compute_tfr(self, subjects: Union[Subject, SubjectGroup]) -> AverageTFRArray:
-        epochs, _, _, stc_epo_array, stc_resting = self._load_complete_data(subjects)
+    @traced("compute_tfr", subject_arg=None)
+    def _compute_tfr(
+        self,
+        subjects: Union[Subject, SubjectGroup],
+        n_jobs: int = 1,
+        complete_data: tuple = None,
+    ) -> "AverageTFRArray":
+        if complete_data is None:
+            complete_data = self._load_complete_data(subjects, n_jobs=n_jobs, resting=False)
+        epochs, _, _, stc_epo_array, stc_resting = complete_data
 
         freqs = np.logspace(*np.log10([1, 100]), num=50)
         n_cycles = freqs / 2.0
 
+        subject_ids = (
+            [subjects.subject_id]
+            if isinstance(subjects, Subject)
+            else [subject.subject_id for subject in subjects.subjects]
+        )
+        cache_key = self.tfr_cache.make_key(
+            subject_ids, stc_epo_array, freqs, n_cycles, self.sfreq, self.dtype
+        )
+        tfr = self.tfr_cache.get(cache_key)
+        if tfr is not None:
+            return tfr
+
+        import mne
+        from mne.time_frequency import AverageTFRArray
+
         info = mne.create_info(
             ch_names=self.roi_acronyms, sfreq=self.sfreq, ch_types="eeg"
         )
 
-        power = tfr_array_morlet(
-            stc_epo_array,
-            sfreq=self.sfreq,
-            freqs=freqs,
-            n_cycles=n_cycles,
-            output="avg_power",
-            zero_mean=False,
-        )
+        with span("morlet_tfr", n_epochs=stc_epo_array.shape[0]):
+            power = MorletTFR(self.sfreq, freqs, n_cycles, dtype=self.dtype).transform(
+                stc_epo_array, output="avg_power"
+            )
 
         tfr = AverageTFRArray(
             info=info,
@@ -60,18 +106,23 @@ class Visualizer:
             freqs=freqs,
             nave=stc_epo_array.shape[0],
         )
+        self.tfr_cache.put(cache_key, tfr)
 
         return tfr
 
+    @traced("plot_tfr", subject_arg=None)
     def _plot_tfr(
         self,
-        tfr: AverageTFRArray,
+        tfr: "AverageTFRArray",
         baseline: tuple,
         title: str,
         time_range: tuple = (-0.2, 0.8),
         vlim: tuple = (None, None),
         orientation: str = "horizontal",
     ):
+        import matplotlib.pyplot as plt
+
+        _set_style()
         if orientation == "vertical":
             fig, axes = plt.subplots(6, 2, figsize=(12, 16), sharex=False, sharey=True)
         elif orientation == "horizontal":
@@ -119,6 +170,50 @@ class Visualizer:
         plt.show()
         return fig
 
+    def _trace_window(self, n_times: int, time_range: tuple):
+        # samples of a centred epoch that fall inside time_range
+        time_min = -n_times / self.sfreq / 2
+        sample_start = max(int((time_range[0] - time_min) * self.sfreq), 0)
+        sample_end = min(int((time_range[1] - time_min) * self.sfreq), n_times)
+        return sample_start, sample_end
+
+    @traced("trace_ci", subject_arg=None)
+    def _trace_ci(
+        self,
+        evoked_data_arrays,
+        time_range: tuple,
+        n_resamples: int = 10000,
+        ci: float = 0.95,
+    ):
+        """Bootstrap CI of the grand-average ERP over subjects, all channels at once
+
+        Returns (lower, upper), each (n_channels, n_window_samples), so any
+        channel can be plotted from one computation. Results are kept in
+        trace_ci_cache, keyed on the evoked data and the settings, like the
+        TFR cache.
+        """
+        from src.analysis.statistical_analysis import bootstrap_ci
+
+        evoked_data_arrays = np.ascontiguousarray(evoked_data_arrays)
+        key = hashlib.sha1()
+        key.update(f"{evoked_data_arrays.shape}{evoked_data_arrays.dtype.str}".encode())
+        key.update(evoked_data_arrays.tobytes())
+        key.update(repr((tuple(time_range), n_resamples, ci, self.sfreq)).encode())
+        key = key.hexdigest()
+        if key in self.trace_ci_cache:
+            self.trace_ci_cache.move_to_end(key)
+            return self.trace_ci_cache[key]
+
+        sample_start, sample_end = self._trace_window(evoked_data_arrays.shape[-1], time_range)
+        trace_ci = bootstrap_ci(
+            evoked_data_arrays[..., sample_start:sample_end], n_resamples=n_resamples, ci=ci
+        )
+        self.trace_ci_cache[key] = trace_ci
+        if len(self.trace_ci_cache) > self.trace_ci_cache_size:
+            self.trace_ci_cache.popitem(last=False)
+        return trace_ci
+
+    @traced("plot_trace", subject_arg=None)
     def _plot_trace(
         self,
         subjects: Union[Subject, SubjectGroup],
@@ -127,19 +222,15 @@ class Visualizer:
         sem_epochs_per_sub,
         channel: str,
         time_range: tuple,
+        n_resamples: int = 10000,
+        ci: float = 0.95,
+        trace_ci: tuple = None,
     ):
-        evoked_averaged = np.nanmean(evoked_data_arrays, axis=0)
-        sem_averaged = np.nanmean(sem_epochs_per_sub, axis=0)
-
-        sfreq = self.sfreq
-        total_duration = evoked_averaged.shape[1] / sfreq
-        time_min = -total_duration / 2
+        import matplotlib.pyplot as plt
 
-        sample_start = int((time_range[0] - time_min) * sfreq)
-        sample_end = int((time_range[1] - time_min) * sfreq)
-
-        sample_start = max(sample_start, 0)
-        sample_end = min(sample_end, evoked_averaged.shape[1])
+        _set_style()
+        evoked_averaged = np.nanmean(evoked_data_arrays, axis=0)
+        sample_start, sample_end = self._trace_window(evoked_averaged.shape[1], time_range)
 
         timepoints = np.linspace(
             time_range[0], time_range[1], sample_end - sample_start
@@ -154,7 +245,20 @@ class Visualizer:
 
         # Get data within the time range
         evoked_averaged = evoked_averaged[channel_index, sample_start:sample_end] * 1e7
-        sem_averaged = sem_averaged[channel_index, sample_start:sample_end] * 1e7
+
+        # group-level band: bootstrap over subjects, cached by _trace_ci for every
+        # channel; a single subject keeps its trial SEM
+        if len(evoked_data_arrays) > 1:
+            if trace_ci is None:
+                trace_ci = self._trace_ci(evoked_data_arrays, time_range, n_resamples, ci)
+            lower = trace_ci[0][channel_index] * 1e7
+            upper = trace_ci[1][channel_index] * 1e7
+            band_label = f"{ci:.0%} bootstrap CI"
+        else:
+            sem = np.nanmean(sem_epochs_per_sub, axis=0)[channel_index, sample_start:sample_end]
+            lower = evoked_averaged - sem * 1e7
+            upper = evoked_averaged + sem * 1e7
+            band_label = "SEM"
 
         fig = plt.figure(figsize=(10, 5))
         plt.plot(
@@ -163,14 +267,13 @@ class Visualizer:
             label=f"Channel {channel}",
         )
 
-        # Plot SEM as shaded area
         plt.fill_between(
             timepoints,
-            evoked_averaged - sem_averaged,
-            evoked_averaged + sem_averaged,
+            lower,
+            upper,
             color="b",
             alpha=0.4,
-            label="SEM",
+            label=band_label,
         )
 
         plt.axvline(x=0, color="red", linestyle="--", label="Stimulus Onset")
@@ -195,11 +298,17 @@ class Visualizer:
         time_range=(-0.2, 0.8),
         vlim=None,
         orientation="vertical",
+        n_jobs=1,
+        n_resamples=10000,
+        ci=0.95,
     ):
-        tfr = self._compute_tfr(subjects)
+        # load once and share between the TFR and trace paths
+        # the resting spectrum is not plotted, so skip its Welch pass
+        complete_data = self._load_complete_data(subjects, n_jobs=n_jobs, resting=False)
+        tfr = self._compute_tfr(subjects, complete_data=complete_data)
 
         epochs, evoked_data_arrays, sem_epochs_per_sub, stc_epo_array, stc_resting = (
-            self._load_complete_data(subjects)
+            complete_data
         )
 
         title = (
@@ -225,6 +334,8 @@ class Visualizer:
             sem_epochs_per_sub,
             channel,
             time_range,
+            n_resamples,
+            ci,
         )
         # if isinstance(subjects, Subject):
         #     trace_fig.savefig(os.path.join(save_fig_path, f"{subjects.subject_id}_epochs_trace.png"),
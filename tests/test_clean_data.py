@@ -0,0 +1,206 @@
+"""clean_data against the loops in notebooks/Preprocessing/preprocess-epo-MISSING_KEY_PRESS.ipynb
+
+The notebook loops are transcribed below as the reference, with their
+prints replaced by collecting the indices they report.
+"""
+import numpy as np
+import pytest
+
+from src.preprocessing.clean_data import (
+    drop_merged_events,
+    drop_repeated_events,
+    find_merged_events,
+    find_repeated_events,
+    get_stim_epochs,
+)
+
+SFREQ = 400
+MS_TO_SAMP = SFREQ / 1000
+SAMPS_TO_MS = 1000 / SFREQ
+CODES = [1, 3, 4, 5, 6, 7, 8, 10, 11, 12, 13]
+
+
+def random_events(rng, n_events, codes=CODES, max_step=600, p_same_sample=0.0):
+    steps = rng.integers(1, max_step, size=n_events)
+    steps[rng.random(n_events) < p_same_sample] = 0
+    return np.column_stack(
+        [np.cumsum(steps) + 1000, np.zeros(n_events, dtype=int), rng.choice(codes, size=n_events)]
+    )
+
+
+def notebook_merged(events_from_annot, delete=True):
+    # cell 10; returns the indices the loop reports deleting and its result.
+    # With several merges its np.delete calls go out of bounds (they use the
+    # original indices on a shrinking copy), so delete=False only reports
+    reported = []
+    merged_flag = 0
+    events_from_annot_new = events_from_annot.copy()
+    for i in range(0, len(events_from_annot) - 1):
+        if (
+            events_from_annot[i][0] == events_from_annot[i + 1][0]
+            and events_from_annot[i][2] < 10
+        ):
+            merged_flag = 1
+            reported.append(i + 1)
+            if delete:
+                events_from_annot_new = np.delete(events_from_annot_new, i + 1, axis=0)
+        elif (
+            events_from_annot[i][0] == events_from_annot[i + 1][0]
+            and events_from_annot[i + 1][2] < 10
+        ):
+            merged_flag = 1
+            reported.append(i)
+            if delete:
+                events_from_annot_new = np.delete(events_from_annot_new, i, axis=0)
+    if merged_flag:
+        events_from_annot = events_from_annot_new
+    return reported, events_from_annot
+
+
+def notebook_repeated(events_from_annot):
+    # cell 12; returns the indices the loop reports and the events it leaves,
+    # which are unchanged because its np.delete is commented out
+    reported = []
+    events_from_annot_new = events_from_annot.copy()
+    for i in range(0, len(events_from_annot_new) - 1):
+        if events_from_annot[i][2] in range(3, 8) and events_from_annot[i + 1][2] in range(3, 8):
+            if i + 2 >= len(events_from_annot):
+                continue  # the notebook would raise IndexError on events_from_annot[i + 2]
+            if (
+                ((events_from_annot[i + 1][0] - events_from_annot[i][0]) < 1000 * MS_TO_SAMP)
+                and (events_from_annot[i][2] == events_from_annot[i + 1][2])
+                and (events_from_annot[i + 2][2] == events_from_annot[i + 1][2])
+            ):
+                reported.append(i)
+    return reported, events_from_annot_new
+
+
+def notebook_get_stim_epochs(
+    epochs, val_list, key_list, events_from_annot_drop_repeats_list, min_dur_stim, max_dur_stim
+):
+    # cell 4 (gap_ITI is unused there too), with the lists the notebook
+    # initializes as globals in cell 19
+    stim_labels, StimOn_ids = [], []
+    key_wo_pp_ids, key_wo_pp_lbls, key_wo_pp_samps_to_ms = [], [], []
+    key_to_pp_lag, pp_updown_dur, ITI_stim_gap = [], [], []
+    events = events_from_annot_drop_repeats_list
+    for i in range(len(epochs) - 1):
+        curr_pos = val_list.index(events[i][-1])
+        curr_key_str = key_list[curr_pos]
+        curr_val = val_list[curr_pos]
+        next_pos = val_list.index(events[i + 1][-1])
+        next_val = val_list[next_pos]
+
+        if (10 in val_list or 12 in val_list) and 3 in val_list:
+            if (curr_val in range(3, 9)) and (next_val in range(10, 14)):
+                StimOn_ids.append(i + 1)
+                stim_labels.append(curr_key_str)
+                key_to_pp_lag.append((events[i + 1][0] - events[i][0]) * SAMPS_TO_MS)
+            elif (curr_val in range(3, 9)) and (next_val not in range(10, 14)):
+                key_wo_pp_ids.append(i)
+                key_wo_pp_lbls.append(curr_key_str)
+                key_wo_pp_samps_to_ms.append(events[i][0] * SAMPS_TO_MS)
+        elif 10 not in val_list or 12 not in val_list:
+            if curr_val in range(3, 9):
+                StimOn_ids.append(i)
+                stim_labels.append(curr_key_str)
+        elif 3 not in val_list:
+            if (
+                (curr_val == 10 or curr_val == 12)
+                and (next_val == 11 or next_val == 13)
+                and (events[i + 1][0] - events[i][0]) > float(min_dur_stim * MS_TO_SAMP)
+                and (events[i + 1][0] - events[i][0]) < float(max_dur_stim * MS_TO_SAMP)
+            ):
+                StimOn_ids.append(i)
+                pp_updown_dur.append((events[i + 1][0] - events[i][0]) * SAMPS_TO_MS)
+                ITI_stim_gap.append((events[i][0] - events[i - 1][0]) * SAMPS_TO_MS)
+    return (
+        stim_labels,
+        StimOn_ids,
+        key_wo_pp_ids,
+        key_wo_pp_lbls,
+        key_wo_pp_samps_to_ms,
+        key_to_pp_lag,
+        pp_updown_dur,
+        ITI_stim_gap,
+    )
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_find_merged_events_matches_notebook(seed):
+    rng = np.random.default_rng(seed)
+    events = random_events(rng, 200, p_same_sample=0.03)
+    reported, _ = notebook_merged(events, delete=False)
+    assert len(reported) > 1
+    np.testing.assert_array_equal(find_merged_events(events), np.unique(reported))
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_drop_merged_events_matches_notebook_with_one_merge(seed):
+    # the notebook deletes from a shrinking copy with the original indices, so
+    # its result is only right when there is at most one merge
+    rng = np.random.default_rng(seed)
+    events = random_events(rng, 100)
+    i = int(rng.integers(0, len(events) - 1))
+    events[i + 1, 0] = events[i, 0]
+    _, expected = notebook_merged(events)
+    np.testing.assert_array_equal(drop_merged_events(events, verbose=False), expected)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_find_repeated_events_matches_notebook(seed):
+    rng = np.random.default_rng(seed)
+    events = random_events(rng, 300, codes=[3, 4, 5, 10, 11], max_step=500)
+    reported, _ = notebook_repeated(events)
+    np.testing.assert_array_equal(find_repeated_events(events, SFREQ), reported)
+
+
+def test_drop_repeated_events_deletes_what_the_notebook_only_counts():
+    events = np.array(
+        [[1000, 0, 3], [1100, 0, 3], [1200, 0, 3], [5000, 0, 10], [9000, 0, 4]]
+    )
+    reported, notebook_events = notebook_repeated(events)
+    assert reported == [0]
+    np.testing.assert_array_equal(notebook_events, events)  # counted, not deleted
+    np.testing.assert_array_equal(
+        drop_repeated_events(events, SFREQ, verbose=False), np.delete(events, [0], axis=0)
+    )
+
+
+PARADIGMS = {
+    "key presses and pinpricks": (
+        [1, 3, 4, 5, 6, 7, 8, 10, 11, 12, 13],
+        ["Start", "Yes Hand", "Med Hand", "No Hand", "Yes Back", "Med Back", "No Back",
+         "PP down L", "PP up L", "PP down H", "PP up H"],
+    ),
+    "key presses only": (
+        [1, 3, 4, 5, 6, 7, 8],
+        ["Start", "Yes Hand", "Med Hand", "No Hand", "Yes Back", "Med Back", "No Back"],
+    ),
+    "pinpricks only": (
+        [1, 10, 11, 12, 13],
+        ["Start", "PP down L", "PP up L", "PP down H", "PP up H"],
+    ),
+    # two keys sharing a code: val_list.index finds the first, as does the lookup
+    "duplicate codes": (
+        [1, 3, 3, 4, 10, 11, 12, 13],
+        ["Start", "Yes Hand", "Yes Hand (old)", "Med Hand", "PP down L", "PP up L",
+         "PP down H", "PP up H"],
+    ),
+}
+
+
+@pytest.mark.parametrize("paradigm", PARADIGMS)
+@pytest.mark.parametrize("seed", range(20))
+def test_get_stim_epochs_matches_notebook(paradigm, seed):
+    val_list, key_list = PARADIGMS[paradigm]
+    rng = np.random.default_rng(seed)
+    events = random_events(rng, 150, codes=sorted(set(val_list)), max_step=800)
+    epochs = range(int(rng.integers(100, 151)))  # only len(epochs) is used
+    expected = notebook_get_stim_epochs(epochs, val_list, key_list, events.tolist(), 255, 1600)
+    result = get_stim_epochs(epochs, val_list, key_list, events.tolist(), 255, 1600, 100, SFREQ)
+    for got, want in zip(result, expected):
+        if want and isinstance(want[0], float):
+            assert got == pytest.approx(want)
+        else:
+            assert got == want